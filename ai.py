@@ -0,0 +1,80 @@
+"""ai.py - Perfect-play AI for Tic-tac-toe.
+
+Every position reachable from the empty board (with either player moving
+first) is solved once per instance with memoized negamax, on first use, so
+choosing a move at request time is a single dictionary lookup.
+
+Positions are keyed by the masks of the player to move and of the opponent
+(see engine.py), which also encodes whose turn it is. Values are from the
+point of view of the player to move: a win is worth 1 plus the number of
+empty cells left when it happens, so faster wins (and slower losses) are
+preferred, and a draw is worth 0."""
+
+import engine
+
+
+def _key(me, opp):
+    return me << engine.CELLS | opp
+
+
+def _solve(me, opp, table):
+    """Solve the position and return its value for the player to move"""
+    key = _key(me, opp)
+    if key in table:
+        return table[key][0]
+    free = engine.free_cells(me, opp)
+    if engine.is_win(opp):
+        # The previous move won the game.
+        value, best = -(len(free) + 1), ()
+    elif not free:
+        value, best = 0, ()
+    else:
+        scores = [(-_solve(opp, me | 1 << cell, table), cell) for cell in free]
+        value = max(score for score, _ in scores)
+        best = tuple(cell for score, cell in scores if score == value)
+    table[key] = (value, best)
+    return value
+
+
+def _build_table():
+    table = {}
+    # The human normally moves first, but solve both openings so the AI can
+    # answer any legal position.
+    _solve(0, 0, table)
+    for cell in range(engine.CELLS):
+        _solve(0, 1 << cell, table)
+    return table
+
+# (value, best_moves) for every reachable position, built by _table().
+_TABLE = None
+
+
+def _table():
+    global _TABLE
+    if _TABLE is None:
+        # Concurrent first requests may both build it; the result is the same.
+        _TABLE = _build_table()
+    return _TABLE
+
+
+def lookup(me, opp):
+    """Return (value, best_moves) for the player owning the 'me' mask"""
+    try:
+        return _table()[_key(me, opp)]
+    except KeyError:
+        raise ValueError('Unreachable position')
+
+
+def best_move(state, mark=engine.AI):
+    """Return the optimal cell for mark to play in the given state"""
+    x, o = engine.from_state(state)
+    me, opp = (x, o) if mark == engine.AI else (o, x)
+    best = lookup(me, opp)[1]
+    if not best:
+        raise ValueError('Game already over')
+    return best[0]
+
+
+def position_count():
+    """Return the number of solved positions"""
+    return len(_table())
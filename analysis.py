@@ -0,0 +1,112 @@
+"""analysis.py - Symmetry-canonicalized cache of board analysis results.
+
+The square board has 8 symmetries (4 rotations, each optionally mirrored).
+Boards that map onto each other share the same winner, game-over status and
+value, and their best moves map onto each other, so results are stored once
+per canonical board: the lexicographically smallest of the 8 images of the
+Game.state string."""
+
+import collections
+
+import ai
+import engine
+
+# SYMMETRIES[s][i] is the cell of the original board that lands on cell i
+# after applying symmetry s.
+_IDENTITY = (0, 1, 2, 3, 4, 5, 6, 7, 8)
+_ROTATE = (6, 3, 0, 7, 4, 1, 8, 5, 2)
+_MIRROR = (2, 1, 0, 5, 4, 3, 8, 7, 6)
+
+
+def _compose(first, second):
+    return tuple(first[cell] for cell in second)
+
+
+def _symmetries():
+    result = []
+    perm = _IDENTITY
+    for _ in range(4):
+        result.append(perm)
+        result.append(_compose(perm, _MIRROR))
+        perm = _compose(perm, _ROTATE)
+    return tuple(result)
+
+SYMMETRIES = _symmetries()
+
+Analysis = collections.namedtuple(
+    'Analysis', ['winner', 'game_over', 'to_move', 'best_moves', 'value'])
+
+
+def transform(state, symmetry):
+    """Return the image of the state under the given symmetry"""
+    return ''.join(state[cell] for cell in symmetry)
+
+
+def canonical(state):
+    """Return (canonical_state, symmetry) for the state"""
+    return min((transform(state, symmetry), symmetry)
+               for symmetry in SYMMETRIES)
+
+
+def _to_move(x, o):
+    """The human 'O' moves first, so 'O' is to move whenever the counts tie"""
+    return engine.HUMAN if bin(o).count('1') <= bin(x).count('1') \
+        else engine.AI
+
+
+def _analyze(state):
+    """Analyze a board from scratch"""
+    x, o = engine.from_state(state)
+    winner = engine.winner(x, o)
+    to_move = _to_move(x, o)
+    me, opp = (o, x) if to_move == engine.HUMAN else (x, o)
+    try:
+        value, best_moves = ai.lookup(me, opp)
+    except ValueError:
+        # Not reachable by legal play, still report the outcome.
+        value, best_moves = 0, ()
+    game_over = bool(winner) or engine.is_full(x, o)
+    return Analysis(winner, game_over, to_move, best_moves, value)
+
+
+class AnalysisCache(object):
+    """Caches board analysis by canonical board and tracks its hit rate"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, state):
+        """Return the Analysis of the state, computing it on a miss"""
+        key, symmetry = canonical(state)
+        result = self._entries.get(key)
+        if result is None:
+            self.misses += 1
+            result = _analyze(key)
+            if len(self._entries) < self.max_entries:
+                self._entries[key] = result
+        else:
+            self.hits += 1
+        if symmetry is _IDENTITY or not result.best_moves:
+            return result
+        # Map the best moves from the canonical board back onto this one.
+        return result._replace(best_moves=tuple(
+            sorted(symmetry[cell] for cell in result.best_moves)))
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        """Return a dict describing the cache usage"""
+        return {'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate}
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""analytics.py - Offline replay and analytics over exported game data.
+
+Reads JSONL exports (optionally gzipped) with one entity per line:
+
+    games:   {"key", "user", "opponent", "state", "game_over", "movecount",
+              "moves", "rows", "cols", "win_length"}
+             moves is a list of cell indices, opponent is set for games
+             between two users
+    history: {"game", "movecount", "state", "player"}
+             sorted by game, then movecount
+    scores:  {"user", "date", "result"}
+    users:   {"key", "name"}
+
+Games with a complete move log are replayed from it. Older games only have
+GameHistory records, which are grouped by game and replayed from the state
+differences. Games that gained a complete log after they were migrated
+still have their history records, which are then skipped: the keys of the
+complete games are kept while the game export is read. Depending on the
+endpoint that made them, history records may lack the final move, so such
+games can count as unfinished. Games between two users are only counted
+(two_player_games): the replay and move quality are about games against
+the AI.
+
+Files are streamed in chunks that are replayed on a process pool, with a
+bounded number of chunks in flight, so memory use does not grow with the
+size of the export. Replays use the same win logic as utils.evaluate
+(mnk.evaluate) and score every 3x3 move against the perfect-play table.
+
+Usage:
+    python analytics.py --games games.jsonl.gz --history history.jsonl.gz \\
+        --scores scores.jsonl.gz --users users.jsonl.gz --workers 4
+"""
+
+import argparse
+import collections
+import gzip
+import itertools
+import json
+import multiprocessing
+import sys
+
+import ai
+import mnk
+
+CHUNK_SIZE = 2000
+
+
+def read_jsonl(path):
+    """Yields one record per line of a JSONL file, gzipped or not"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as lines:
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield json.loads(line.decode('utf-8'))
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    """Yields lists of at most size items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def complete(game):
+    """True if the game record has a complete move log"""
+    return not game.get('legacy') and \
+        len(game.get('moves') or []) == game.get('movecount', 0)
+
+
+def track_complete(games, keys):
+    """Passes the game records through, adding the keys of those with a
+    complete move log to keys"""
+    for game in games:
+        if complete(game):
+            keys.add(game['key'])
+        yield game
+
+
+def history_games(records, skip=()):
+    """Groups GameHistory records by game and yields one game record per
+    group, with the moves recovered from the state differences. Games whose
+    key is in skip are left out."""
+    for game_key, group in itertools.groupby(records, lambda r: r['game']):
+        if game_key in skip:
+            continue
+        moves = []
+        previous = None
+        for record in group:
+            state = record['state']
+            if previous is None:
+                previous = '-' * len(state)
+            moves.extend(cell for cell, (old, new)
+                         in enumerate(zip(previous, state)) if old != new)
+            previous = state
+        yield {'key': game_key, 'moves': moves, 'legacy': True}
+
+
+def replay(game, stats):
+    """Replays one game and adds its aggregates to stats"""
+    if game.get('opponent'):
+        stats['two_player'] += 1
+        return
+    rows = game.get('rows') or 3
+    cols = game.get('cols') or 3
+    win_length = game.get('win_length') or 3
+    moves = game.get('moves') or []
+    if not game.get('legacy') and not complete(game):
+        # Incomplete log: the game is replayed from its history records.
+        return
+    board = ['-'] * (rows * cols)
+    tictactoe = (rows, cols, win_length) == (3, 3, 3)
+    x = o = 0
+    winner = None
+    for index, cell in enumerate(moves):
+        mark = 'O' if index % 2 == 0 else 'X'
+        if tictactoe:
+            me, opp = (o, x) if mark == 'O' else (x, o)
+            value, best = ai.lookup(me, opp)
+            chosen = -ai.lookup(opp, me | 1 << cell)[0]
+            stats[('moves', mark)] += 1
+            stats[('optimal', mark)] += cell in best
+            stats[('value_lost', mark)] += value - chosen
+            if mark == 'O':
+                o |= 1 << cell
+            else:
+                x |= 1 << cell
+        board[cell] = mark
+        winner = mnk.evaluate(''.join(board), rows, cols, win_length)
+        if winner:
+            break
+    if winner == 'O':
+        result = 'Win'
+    elif winner == 'X':
+        result = 'Lose'
+    elif moves and '-' not in board:
+        result = 'Draw'
+    else:
+        result = 'Unfinished'
+    stats['games'] += 1
+    stats[('result', result)] += 1
+    stats[('variant', '{}x{}/{}'.format(rows, cols, win_length))] += 1
+    if result != 'Unfinished':
+        stats['finished'] += 1
+        stats['finished_moves'] += index + 1
+        stats[('opening', moves[0], result)] += 1
+
+
+def replay_chunk(games):
+    """Replays a chunk of games, run in the worker processes"""
+    stats = collections.Counter()
+    for game in games:
+        replay(game, stats)
+    return stats
+
+
+def bounded_imap(pool, func, chunks, max_pending):
+    """Like pool.imap_unordered, but reads at most max_pending chunks ahead
+    of the results so memory use stays constant"""
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(func, (chunk,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def user_breakdown(scores, names):
+    """Returns {user: {result: count}} from Score records"""
+    results = collections.defaultdict(collections.Counter)
+    for score in scores:
+        user = names.get(score['user'], score['user'])
+        results[user][score['result']] += 1
+    return dict((user, dict(counts)) for user, counts in results.items())
+
+
+def report(stats, users=None):
+    """Builds the summary from the merged aggregates"""
+    openings = collections.defaultdict(collections.Counter)
+    for key, count in stats.items():
+        if isinstance(key, tuple) and key[0] == 'opening':
+            openings[key[1]][key[2]] += count
+    summary = {
+        'games': stats['games'],
+        'two_player_games': stats['two_player'],
+        'results': dict((key[1], count) for key, count in stats.items()
+                        if isinstance(key, tuple) and key[0] == 'result'),
+        'variants': dict((key[1], count) for key, count in stats.items()
+                         if isinstance(key, tuple) and key[0] == 'variant'),
+        'average_length': float(stats['finished_moves']) / stats['finished']
+        if stats['finished'] else 0.0,
+        'openings': dict(
+            (cell, {'games': sum(counts.values()),
+                    'win_rate': float(counts['Win']) / sum(counts.values()),
+                    'draw_rate': float(counts['Draw']) / sum(counts.values()),
+                    'loss_rate': float(counts['Lose']) / sum(counts.values())})
+            for cell, counts in openings.items()),
+        'move_quality': dict(
+            (player, {'moves': stats[('moves', mark)],
+                      'optimal_rate': float(stats[('optimal', mark)]) /
+                      stats[('moves', mark)],
+                      'average_value_lost': float(stats[('value_lost', mark)]) /
+                      stats[('moves', mark)]})
+            for player, mark in (('human', 'O'), ('ai', 'X'))
+            if stats[('moves', mark)]),
+    }
+    if users is not None:
+        summary['users'] = users
+    return summary
+
+
+def run(games=None, history=None, scores=None, users=None, workers=None):
+    """Replays the exported files and returns the summary"""
+    streams = []
+    # Filled while the games are read, before the history is grouped.
+    complete_keys = set()
+    if games:
+        streams.append(track_complete(read_jsonl(games), complete_keys))
+    if history:
+        streams.append(history_games(read_jsonl(history), complete_keys))
+    stats = collections.Counter()
+    pool = multiprocessing.Pool(workers)
+    try:
+        for partial in bounded_imap(pool, replay_chunk,
+                                    chunked(itertools.chain(*streams)),
+                                    max_pending=2 * (workers or
+                                                     multiprocessing.cpu_count())):
+            stats.update(partial)
+    finally:
+        pool.close()
+        pool.join()
+    breakdown = None
+    if scores:
+        names = dict((user['key'], user['name'])
+                     for user in read_jsonl(users)) if users else {}
+        breakdown = user_breakdown(read_jsonl(scores), names)
+    return report(stats, breakdown)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', help='Game export (JSONL)')
+    parser.add_argument('--history', help='GameHistory export (JSONL)')
+    parser.add_argument('--scores', help='Score export (JSONL)')
+    parser.add_argument('--users', help='User export (JSONL), for names')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+    summary = run(args.games, args.history, args.scores, args.users,
+                  args.workers)
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
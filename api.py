@@ -6,30 +6,132 @@ primarily with communication to/from the API's users."""
 
 
 import logging
+import random
+import time
+
 import endpoints
 from protorpc import remote, messages
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
+from google.appengine.api import oauth
 
-from models import User, Game, Score, GameHistory
+from models import User, Game, Score, GameHistory, user_names,\
+    DELETED_USER_NAME
 from models import StringMessage, NewGameForm, GameForm, MakeMoveForm,\
-    ScoreForms, GameHistoryForms, GameForms, UserForms
-from utils import get_by_urlsafe, evaluate, parseState, add_random_move
+    MakeMovesForm, ScoreForms, GameHistoryForms, GameForms, UserForms,\
+    EndpointStatsForm, EndpointStatsForms, RpcCountForm, MoveHintForm,\
+    MoveHintForms, MatchForm
+from utils import get_by_urlsafe, fetch_page, evaluate,\
+    check_ai_mode, choose_ai_move, clamp_page_size, analysis_cache
+import book
+import counters
+import gamecache
+import matchmaking
+import mnk
+from gamecache import GameSession
+from instrumentation import instrumented, endpoint_stats
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
         urlsafe_game_key=messages.StringField(1),)
+WAIT_FOR_TURN_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_key=messages.StringField(1),
+        version=messages.IntegerField(2),)
+MATCH_REQUEST = endpoints.ResourceContainer(
+        user_name=messages.StringField(1, required=True),)
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
         MakeMoveForm,
         urlsafe_game_key=messages.StringField(1),)
-GET_RANDOM_MOVE_REQUEST = endpoints.ResourceContainer(urlsafe_game_key = messages.StringField(1),)
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(
+        MakeMovesForm,
+        urlsafe_game_key=messages.StringField(1),)
+GET_RANDOM_MOVE_REQUEST = endpoints.ResourceContainer(urlsafe_game_key = messages.StringField(1),
+                                                     mode = messages.StringField(2),
+                                                     request_id = messages.StringField(3),)
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                            email=messages.StringField(2))
-GET_USER_GAME_REQUEST = endpoints.ResourceContainer(user_name = messages.StringField(1, required = True),)
+GET_USER_GAME_REQUEST = endpoints.ResourceContainer(user_name = messages.StringField(1, required = True),
+                                                   page_size = messages.IntegerField(2),
+                                                   cursor = messages.StringField(3),)
+GET_GAME_HISTORY_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_key=messages.StringField(1),
+        page_size=messages.IntegerField(2),
+        cursor=messages.StringField(3),)
+USER_SCORES_REQUEST = endpoints.ResourceContainer(
+        user_name=messages.StringField(1),
+        page_size=messages.IntegerField(2),
+        cursor=messages.StringField(3),)
+PAGE_REQUEST = endpoints.ResourceContainer(
+        page_size=messages.IntegerField(1),
+        cursor=messages.StringField(2),)
+
+# OAuth client ids whose tokens identify the caller: the API Explorer, plus
+# the ids of the app's own clients.
+ALLOWED_CLIENT_IDS = [endpoints.API_EXPLORER_CLIENT_ID]
+# Accounts allowed to call the admin endpoints, besides the app's admins.
+ADMIN_EMAILS = ()
+
+
+def _check_admin():
+    """Raises UnauthorizedException unless the caller's OAuth token belongs
+    to an app admin or to one of ADMIN_EMAILS"""
+    current = endpoints.get_current_user()
+    if current is None:
+        raise endpoints.UnauthorizedException('Sign in as an admin')
+    if current.email() in ADMIN_EMAILS:
+        return
+    try:
+        if oauth.is_current_user_admin(endpoints.EMAIL_SCOPE):
+            return
+    except oauth.Error:
+        pass
+    raise endpoints.UnauthorizedException('Admins only')
+
+
+# Attempts of a move request that conflicts with concurrent requests, and
+# the base of the random backoff between them in seconds.
+MOVE_ATTEMPTS = 3
+RETRY_DELAY = 0.05
+
+
+def _update_game(urlsafe_game_key, request_id, update):
+    """Loads the game, applies update(session, game) and returns its result.
+    The game is reloaded and update retried if a concurrent request changed
+    it first. A request whose request_id was already applied returns the
+    current game instead, so clients can safely resend moves."""
+    for attempt in range(MOVE_ATTEMPTS):
+        session = GameSession(urlsafe_game_key, request_id)
+        game = session.load()
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if request_id and request_id in game.request_ids:
+            return game.to_form('Move already made.')
+        try:
+            return update(session, game)
+        except gamecache.Conflict:
+            if attempt == MOVE_ATTEMPTS - 1:
+                raise
+            logging.info('Conflict on game %s, retrying', urlsafe_game_key)
+            time.sleep(random.uniform(0, RETRY_DELAY * 2 ** attempt))
 
-MEMCACHE_ACTIVE_GAMES = 'ACTIVE_GAMES'
 
-@endpoints.api(name='tic_tac_toe', version='v1')
+def _end_game(session, game, result):
+    """Claims the cached game, ends it in the datastore, then refreshes the
+    game cache. The claim is taken back if the game could not be ended, so
+    a retry does not find the request already recorded."""
+    session.save(game, defer=False)
+    try:
+        ended = game.end_game(result)
+    except Exception:
+        session.undo()
+        raise
+    if not ended:
+        # The datastore copy is newer than the cached one: drop the latter.
+        session.undo(restore=False)
+        raise gamecache.Conflict()
+    session.saved(game)
+
+@endpoints.api(name='tic_tac_toe', version='v1',
+               allowed_client_ids=ALLOWED_CLIENT_IDS,
+               scopes=[endpoints.EMAIL_SCOPE])
 class TicTacToeApi(remote.Service):
     """Game API"""
     @endpoints.method(request_message=USER_REQUEST,
@@ -37,13 +139,12 @@ class TicTacToeApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
     def create_user(self, request):
         """Create a User. Requires a unique username"""
-        if User.query(User.name == request.user_name).get():
+        if not User.create(request.user_name, request.email):
             raise endpoints.ConflictException(
                     'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email, rankingscore = 0)
-        user.put()
         return StringMessage(message='User {} created!'.format(
                 request.user_name))
 
@@ -52,17 +153,21 @@ class TicTacToeApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrumented
     def new_game(self, request):
         """Creates new game"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        game = Game.new_game(user.key)
-        # Use a task queue to update the active games.
-        # This operation is not needed to complete the creation of a new game
-        # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_active_games')
+        ai_mode = request.ai_mode or 'random'
+        try:
+            mnk.variant(request.rows, request.cols, request.win_length)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        check_ai_mode(ai_mode, request.rows, request.cols, request.win_length)
+        game = Game.new_game(user.key, ai_mode, request.rows, request.cols,
+                             request.win_length)
         return game.to_form('Good luck playing Tic-tac-toe!')
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
@@ -70,9 +175,10 @@ class TicTacToeApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrumented
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = GameSession(request.urlsafe_game_key).load()
         if game:
             if game.player:
                 return game.to_form('Time to make a move!')
@@ -86,15 +192,22 @@ class TicTacToeApi(remote.Service):
                       path = "game/{user_name}/active",
                       name = 'get_user_games',
                       http_method = 'GET')
+    @instrumented
     def get_user_game(self,request):
         """Return active games for specified user"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
         games = Game.query(Game.user == user.key)
         active_games = games.filter(Game.game_over == False)
-        return GameForms(items = [game.to_form("Time to make a move!") for game in active_games])
+        active_games, next_cursor = fetch_page(active_games, request.page_size,
+                                               request.cursor)
+        # The cached state may show games ended since the query.
+        return GameForms(items = [game.to_form("Time to make a move!", user.name)
+                                  for game in gamecache.refresh(active_games)
+                                  if not game.game_over],
+                         next_cursor = next_cursor)
 
 
     @endpoints.method(request_message = GET_GAME_REQUEST,
@@ -102,19 +215,23 @@ class TicTacToeApi(remote.Service):
                        path = "game/{urlsafe_game_key}/cancel",
                        name = 'cancel_game',
                        http_method = 'DELETE')
+    @instrumented
     def cancel_game(self,request):
         """Cancel unfinished game"""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
         if game:
             if game.game_over:
-                return Message(message = "Completed Game cannot be deleted.")
+                return StringMessage(message = "Completed Game cannot be deleted.")
             else:
                 try:
-                    game.key.delete()
+                    cancelled = game.cancel()
+                    gamecache.forget(request.urlsafe_game_key)
                 except Exception:
                     raise endpoints.InternalServerErrorException(
                         'Error in cencelling the game')
-            return Message(message = "Game Deleted")
+                if not cancelled:
+                    return StringMessage(message = "Completed Game cannot be deleted.")
+            return StringMessage(message = "Game Deleted")
         else:
             raise endpoints.NotFoundException('Game not found!')
 
@@ -127,48 +244,76 @@ class TicTacToeApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrumented
     def make_move(self, request):
         """Makes a move. Returns a game state with message. """
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        def update(session, game):
+            if game.opponent:
+                return self._two_player_move(session, game, request.move,
+                                             request.user_name)
+            return self._make_move(session, game, request.move)
+        return _update_game(request.urlsafe_game_key, request.request_id,
+                            update)
+
+    @classmethod
+    def _two_player_move(cls, session, game, move, user_name):
+        """Applies the move of one of the users of a two-player game and
+        saves it"""
+        if game.game_over:
+            return game.to_form('Game already over!')
+        user = User.get_by_name(user_name) if user_name else None
+        if not user or user.key not in (game.user, game.opponent):
+            raise endpoints.BadRequestException(
+                'user_name must be one of the players of this game')
+        if user.key != (game.user if game.player else game.opponent):
+            return game.to_form('This is not your turn')
+        result = cls._apply_move(game, move, None)
+        if result:
+            _end_game(session, game, result)
+            return game.to_form('This is a Draw.' if result == "Draw"
+                                else 'You win!')
+        session.save(game)
+        return game.to_form("Your opponent's turn")
+
+    @staticmethod
+    def _make_move(session, game, move):
+        """Applies a human move to the loaded game and saves it"""
         #check if the game is over, update the score list if needed
-        if evaluate(game.state):
-            outcome = evaluate(game.state)
-            if outcome == "O":
-                msg = "Win"
-            else:
-                msg = "Lose"
-            game.end_game(msg)
-            game.game_over = True
-            game.put()
-        else:
-            if "-" not in game.state:
-              game.end_game("Draw")
-              game.game_over = True
+        if not game.game_over:
+            outcome = evaluate(game.state, *game.dimensions)
+            if outcome:
+                if outcome == "O":
+                    msg = "Win"
+                else:
+                    msg = "Lose"
+                _end_game(session, game, msg)
+            elif "-" not in game.state:
+                _end_game(session, game, "Draw")
         if game.game_over:
             return game.to_form('Game already over!')
         #check if it is player's turn
         if game.player:
-            if request.move not in range(0,9):
+            if move not in range(0, len(game.state)):
               raise endpoints.BadRequestException('Invalid Move')
-            if game.state[request.move] != "-":
+            if game.state[move] != "-":
               raise endpoints.BadRequestException('Invalid Move')
             #update the board state
             board = list(game.state)
-            board[request.move] = "O" 
+            board[move] = "O" 
             game.state = ''.join(board)
             #update movecount
             game.movecount += 1
+            game.record_move(move)
             #evaluate the result
-            if evaluate(game.state):
-                game.end_game("Win")
+            if evaluate(game.state, *game.dimensions):
+                _end_game(session, game, "Win")
                 return game.to_form('You win!')
             if "-" not in game.state:
-                game.end_game("Draw")
+                _end_game(session, game, "Draw")
                 return game.to_form('This is a Draw.')
             msg = "AI's turn"
-            game.history()
             game.player = False
-            game.put()
+            session.save(game)
             return game.to_form(msg)
         else:
             msg = "This is not your turn"
@@ -179,24 +324,32 @@ class TicTacToeApi(remote.Service):
                       path = 'game/{urlsafe_game_key}/random',
                       name = "get_random_move",
                       http_method = "PUT")
+    @instrumented
     def get_random_move(self,request):
-        """Get Random Generated Moves"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        """Get the AI move, random, perfect or searched depending on the AI mode"""
+        return _update_game(request.urlsafe_game_key, request.request_id,
+                            lambda session, game:
+                                self._ai_move(session, game, request.mode))
+
+    @staticmethod
+    def _ai_move(session, game, mode):
+        """Applies an AI move to the loaded game and saves it"""
+        if game.opponent:
+            raise endpoints.BadRequestException(
+                'This game is played by two users')
+        ai_mode = mode or game.ai_mode or 'random'
+        check_ai_mode(ai_mode, *game.dimensions)
         #check if the game is over, update the score list if needed
-        if evaluate(game.state):
-            outcome = evaluate(game.state)
-            if outcome == "O":
-                msg = "Win"
-                game.end_game(msg)
-            else:
-                msg = "Lose"
-                game.end_game(msg)
-            game.game_over = True
-            game.put()
-        else:
-            if "-" not in game.state:
-              game.end_game("Draw")
-              game.game_over = True
+        if not game.game_over:
+            outcome = evaluate(game.state, *game.dimensions)
+            if outcome:
+                if outcome == "O":
+                    msg = "Win"
+                else:
+                    msg = "Lose"
+                _end_game(session, game, msg)
+            elif "-" not in game.state:
+                _end_game(session, game, "Draw")
         if game.game_over:
             return game.to_form('Game already over!')
         #check if it is ai's turn
@@ -204,96 +357,282 @@ class TicTacToeApi(remote.Service):
             msg = "Waiting for your move."
             return game.to_form(msg)
         else:
-            #update board with a random move
-            game.state = add_random_move(game.state)
+            #update board with the AI move
+            move = choose_ai_move(game.state, ai_mode, *game.dimensions)
+            board = list(game.state)
+            board[move] = "X"
+            game.state = ''.join(board)
             #update movecount
             game.movecount += 1
+            game.record_move(move)
             #evaluate the result
-            if evaluate(game.state):
-                game.end_game("Lose")
+            if evaluate(game.state, *game.dimensions):
+                _end_game(session, game, "Lose")
                 return game.to_form('You Lose!')
             if "-" not in game.state:
-                game.end_game("Draw")
+                _end_game(session, game, "Draw")
                 return game.to_form('This is a Draw.')
             msg = "Your turn"
-            game.history()
             game.player = True
-            game.put()
+            session.save(game)
             return game.to_form(msg)
 
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/moves',
+                      name='make_moves',
+                      http_method='PUT')
+    @instrumented
+    def make_moves(self, request):
+        """Makes a sequence of human moves, each optionally answered by the AI.
+        The game and its move log are saved with a single write."""
+        return _update_game(request.urlsafe_game_key, request.request_id,
+                            lambda session, game:
+                                self._make_moves(session, game, request))
+
+    @classmethod
+    def _make_moves(cls, session, game, request):
+        """Applies the moves of a make_moves request and saves the game"""
+        if game.opponent:
+            raise endpoints.BadRequestException(
+                'This game is played by two users')
+        if game.game_over:
+            return game.to_form('Game already over!')
+        ai_mode = request.mode or game.ai_mode or 'random'
+        check_ai_mode(ai_mode, *game.dimensions)
+        result = None
+        if request.ai_reply and not game.player:
+            result = cls._apply_move(game, None, ai_mode)
+        for move in request.moves:
+            if result:
+                raise endpoints.BadRequestException(
+                    'The game ended before all moves were made')
+            if not game.player:
+                raise endpoints.BadRequestException('This is not your turn')
+            result = cls._apply_move(game, move, ai_mode)
+            if request.ai_reply and not result:
+                result = cls._apply_move(game, None, ai_mode)
+        if result:
+            _end_game(session, game, result)
+        else:
+            session.save(game)
+        if result == "Win":
+            return game.to_form('You win!')
+        if result == "Lose":
+            return game.to_form('You Lose!')
+        if result == "Draw":
+            return game.to_form('This is a Draw.')
+        return game.to_form("Your turn" if game.player else "AI's turn")
+
+    @staticmethod
+    def _apply_move(game, move, ai_mode):
+        """Applies one move to the game in memory, including its move log.
+        move is None for the AI player. Returns the result ("Win", "Lose",
+        "Draw") if the move ended the game, otherwise None."""
+        if move is None:
+            move = choose_ai_move(game.state, ai_mode, *game.dimensions)
+        elif move not in range(0, len(game.state)) or \
+                game.state[move] != "-":
+            raise endpoints.BadRequestException('Invalid Move')
+        board = list(game.state)
+        board[move] = "O" if game.player else "X"
+        game.state = ''.join(board)
+        game.movecount += 1
+        game.record_move(move)
+        outcome = evaluate(game.state, *game.dimensions)
+        if outcome:
+            return "Win" if outcome == "O" else "Lose"
+        if "-" not in game.state:
+            return "Draw"
+        game.player = not game.player
+        return None
+
+# - - - Two-player games - - - - - - - - - - - -
+
+    @endpoints.method(request_message = MATCH_REQUEST,
+                      response_message = MatchForm,
+                      path = 'match',
+                      name = 'find_match',
+                      http_method = 'POST')
+    @instrumented
+    def find_match(self, request):
+        """Pairs the user with a waiting user of a similar rankingscore for
+        a two-player game. Waits for an opponent for a while; call again
+        while no game is returned."""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        game = matchmaking.find_match(user)
+        if not game:
+            return MatchForm(message = 'Waiting for an opponent')
+        return MatchForm(message = 'Opponent found!',
+                         game = game.to_form("Game started"))
+
+    @endpoints.method(request_message = MATCH_REQUEST,
+                      response_message = StringMessage,
+                      path = 'match/{user_name}',
+                      name = 'leave_match',
+                      http_method = 'DELETE')
+    @instrumented
+    def leave_match(self, request):
+        """Stops waiting for an opponent"""
+        user = User.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        if not matchmaking.queue.leave(user.key):
+            return StringMessage(message = 'Not waiting for an opponent')
+        return StringMessage(message = 'Left the matchmaking queue')
+
+    @endpoints.method(request_message = WAIT_FOR_TURN_REQUEST,
+                      response_message = GameForm,
+                      path = 'game/{urlsafe_game_key}/wait',
+                      name = 'wait_for_turn',
+                      http_method = 'GET')
+    @instrumented
+    def wait_for_turn(self, request):
+        """Long polling: returns the game as soon as its version is no longer
+        the given one (e.g. the opponent moved), or unchanged after a while"""
+        game = gamecache.wait_for_change(request.urlsafe_game_key,
+                                         request.version)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.version == request.version:
+            return game.to_form('No change yet')
+        return game.to_form('Game updated')
+
 # -------- Queries ------------------
 
-    @endpoints.method(request_message = GET_GAME_REQUEST,
+    @endpoints.method(request_message = GET_GAME_HISTORY_REQUEST,
                       response_message = GameHistoryForms,
                       path = 'game/{urlsafe_game_key}/history',
                       name = 'get_game_history',
                       http_method = 'GET'
                       )
+    @instrumented
     def get_game_history(self,request):
         """Return moves for specified game"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        return GameHistoryForms(items = [record.to_form() for record in \
-           GameHistory.query(GameHistory.game == game.key).order(GameHistory.movecount)])
+        game = GameSession(request.urlsafe_game_key).load()
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if not game.has_move_log():
+            # Older games keep their history as GameHistory entities.
+            records, next_cursor = fetch_page(
+                GameHistory.query(GameHistory.game == game.key)
+                .order(GameHistory.movecount), request.page_size, request.cursor)
+            return GameHistoryForms(items = [record.to_form() for record in records],
+                                    next_cursor = next_cursor)
+        # The cursor of a move log page is the index of its first move.
+        try:
+            start = int(request.cursor or 0)
+        except ValueError:
+            raise endpoints.BadRequestException('Invalid cursor')
+        count = clamp_page_size(request.page_size)
+        next_cursor = str(start + count) if start + count < game.movecount \
+            else None
+        return GameHistoryForms(items = game.history_forms(start, count),
+                                next_cursor = next_cursor)
 
 
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message = GET_GAME_REQUEST,
+                      response_message = MoveHintForms,
+                      path = 'game/{urlsafe_game_key}/hint',
+                      name = 'get_move_hint',
+                      http_method = 'GET')
+    @instrumented
+    def get_move_hint(self, request):
+        """Rate every legal move of the player to move, best first"""
+        game = GameSession(request.urlsafe_game_key).load()
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.dimensions != (3, 3, 3):
+            raise endpoints.BadRequestException(
+                'Move hints are only available on 3x3 boards')
+        return MoveHintForms(items = [
+            MoveHintForm(move = hint.move, value = hint.value,
+                         distance = hint.distance)
+            for hint in book.hints(game.state)])
+
+
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
+    @instrumented
     def get_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query()])
+        """Return all scores, one page at a time"""
+        scores, next_cursor = fetch_page(
+            Score.query(), request.page_size, request.cursor,
+            projection=[Score.user, Score.date, Score.result])
+        names = user_names(score.user for score in scores)
+        return ScoreForms(items=[score.to_form(names.get(score.user,
+                                                         DELETED_USER_NAME))
+                                 for score in scores],
+                          next_cursor=next_cursor)
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_SCORES_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @instrumented
     def get_user_scores(self, request):
         """Returns all of an individual User's scores"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        scores, next_cursor = fetch_page(
+            Score.query(Score.user == user.key), request.page_size,
+            request.cursor, projection=[Score.date, Score.result])
+        return ScoreForms(items=[score.to_form(user.name) for score in scores],
+                          next_cursor=next_cursor)
 
     @endpoints.method(response_message=StringMessage,
                       path='games/active_games',
                       name='get_active_games',
                       http_method='GET')
+    @instrumented
     def get_active_games(self, request):
-        """Get the cached active games"""
-        return StringMessage(message=memcache.get(MEMCACHE_ACTIVE_GAMES) or '')
+        """Get the count of active games from the sharded counter"""
+        return StringMessage(message='The number of active game(s) is {}'
+                             .format(counters.get_count()))
 
 
-    @endpoints.method(response_message = UserForms,
+    @endpoints.method(request_message = PAGE_REQUEST,
+                      response_message = UserForms,
                       path = 'ranking',
                       name = 'get_ranking',
                       http_method = 'GET')
+    @instrumented
     def get_user_rankings(self, request):
-        """Get user rankings"""
-        users = User.query()
-        for user in users:
-            games = Score.query(Score.user == user.key)
-            win = Score.query().filter(Score.result == 'Win').fetch()
-            draw = Score.query().filter(Score.result == 'Draw').fetch()
-            lose = Score.query().filter(Score.result == "Lose").fetch()
-            # The final score is base on both performance and participation.
-            final_score = 5*len(win) + 3*len(win)+ 1*len(lose)
-            user.rankingscore = final_score
-            user.put()
-        return UserForms(items=[user.to_form() for user in User.query().order(-User.rankingscore)])
+        """Get user rankings, one page at a time"""
+        # The rankingscore is kept up to date by Game.end_game.
+        users, next_cursor = fetch_page(User.query().order(-User.rankingscore),
+                                        request.page_size, request.cursor)
+        return UserForms(items=[user.to_form() for user in users],
+                         next_cursor=next_cursor)
 
 
-    @staticmethod
-    def _cache_active_games():
-        """Populates memcache with the count of active games"""
-        games = Game.query(Game.game_over == False).fetch()
-        if games:
-            count = len(games)
-            memcache.set(MEMCACHE_ACTIVE_GAMES,
-                         'The number of active game(s) is {}'.format(count))
+# -------- Admin ------------------
+
+    @endpoints.method(response_message = EndpointStatsForms,
+                      path = 'admin/stats',
+                      name = 'get_endpoint_stats',
+                      http_method = 'GET')
+    def get_endpoint_stats(self, request):
+        """Rolling latency and RPC statistics of every endpoint served by
+        this instance. Admins only."""
+        _check_admin()
+        items = []
+        for stats in endpoint_stats():
+            rpcs = [RpcCountForm(name=name, mean=mean)
+                    for name, mean in sorted(stats.pop('rpcs').items())]
+            items.append(EndpointStatsForm(rpcs=rpcs, **stats))
+        return EndpointStatsForms(
+            items=items, analysis_cache_hit_rate=analysis_cache.hit_rate)
 
 
 api = endpoints.api_server([TicTacToeApi])
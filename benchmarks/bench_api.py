@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""bench_api.py - Load test of complete TicTacToeApi game flows against the
+App Engine testbed stubs.
+
+Each game runs create_user -> new_game -> alternating make_move /
+get_random_move until the game ends -> get_game_history ->
+get_user_rankings, calling the endpoint methods directly. Every call is
+treated as a separate request (the ndb context cache is cleared before it)
+and its latency and API calls by service are recorded.
+
+Usage:
+    python benchmarks/bench_api.py [--sdk PATH] [--games N] [--ai-mode MODE]
+        [--update-baseline]
+
+Latency percentiles and the mean RPC counts per endpoint are printed and
+compared with benchmarks/baseline.json; the script exits with status 1 if
+an endpoint got slower or makes more API calls."""
+
+import argparse
+import collections
+import sys
+import time
+
+import common
+
+SECTION = 'api'
+# More API calls per request than the baseline by this much is a regression.
+RPC_TOLERANCE = 0.1
+
+
+class RpcCounter(object):
+    """Counts the API calls made through the apiproxy, by service.call"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def record(self, service, call, request, response):
+        """Post-call hook of the apiproxy (hooks must be functions or
+        methods)"""
+        self.counts['{}.{}'.format(service, call)] += 1
+
+    def reset(self):
+        counts, self.counts = self.counts, collections.Counter()
+        return counts
+
+
+def start_testbed():
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    # Endpoints reads the app revision from the part after the dot.
+    bed.setup_env(overwrite=True, app_id='tictactoe-mj',
+                  current_version_id='1.1')
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=common.ROOT)
+    bed.init_mail_stub()
+    bed.init_app_identity_stub()
+    bed.init_user_stub()
+    counter = RpcCounter()
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'bench_rpc_counter', counter.record)
+    return bed, counter
+
+
+def run(games, ai_mode):
+    from google.appengine.ext import ndb
+    from protorpc import message_types
+
+    import api
+
+    service = api.TicTacToeApi()
+    latencies = collections.defaultdict(list)
+    rpcs = collections.defaultdict(collections.Counter)
+    calls = collections.Counter()
+    bed, counter = start_testbed()
+
+    def call(name, container, **fields):
+        request = container.combined_message_class(**fields) \
+            if container is not None else message_types.VoidMessage()
+        ndb.get_context().clear_cache()
+        counter.reset()
+        start = time.time()
+        response = getattr(service, name)(request)
+        latencies[name].append(time.time() - start)
+        rpcs[name].update(counter.reset())
+        calls[name] += 1
+        return response
+
+    try:
+        for index in range(games):
+            user_name = 'bench-user-{}'.format(index)
+            call('create_user', api.USER_REQUEST, user_name=user_name)
+            game = call('new_game', api.NEW_GAME_REQUEST, user_name=user_name,
+                        ai_mode=ai_mode)
+            key = game.urlsafe_key
+            while not game.game_over:
+                if game.player:
+                    game = call('make_move', api.MAKE_MOVE_REQUEST,
+                                urlsafe_game_key=key,
+                                move=game.state.index('-'))
+                else:
+                    game = call('get_random_move',
+                                api.GET_RANDOM_MOVE_REQUEST,
+                                urlsafe_game_key=key)
+            call('get_game_history', api.GET_GAME_HISTORY_REQUEST,
+                 urlsafe_game_key=key)
+            call('get_user_rankings', api.PAGE_REQUEST)
+    finally:
+        bed.deactivate()
+
+    results = {}
+    for name, samples in latencies.items():
+        result = common.summarize(samples)
+        result['rpcs'] = dict((rpc, float(count) / calls[name])
+                              for rpc, count in rpcs[name].items())
+        results[name] = result
+    return results
+
+
+def compare_rpcs(results):
+    """Prints the API calls that endpoints make more often than in the
+    baseline and returns those endpoints"""
+    baseline = common.load_baseline().get(SECTION, {})
+    regressions = []
+    for name in sorted(results):
+        previous = baseline.get(name, {}).get('rpcs', {})
+        for rpc, count in sorted(results[name]['rpcs'].items()):
+            if count > previous.get(rpc, 0) + RPC_TOLERANCE:
+                print('  {}: {} {:.1f} per request, baseline {:.1f}'
+                      '  REGRESSION'.format(name, rpc, count,
+                                            previous.get(rpc, 0)))
+                regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', help='Path to the App Engine SDK')
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--ai-mode', default='perfect')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store these results as the new baseline')
+    args = parser.parse_args(argv)
+    common.setup_sdk(args.sdk)
+
+    results = run(args.games, args.ai_mode)
+    print('{:<40} {:>12} {:>12} {:>8}'.format('endpoint', 'p50 (us)',
+                                              'baseline', 'change'))
+    regressions = common.compare(SECTION, results)
+    print('')
+    print('{:<40} {:>12} {:>12}'.format('endpoint', 'p95 (us)', 'p99 (us)'))
+    for name in sorted(results):
+        print('{:<40} {:>12.1f} {:>12.1f}'.format(
+            name, results[name]['p95_us'], results[name]['p99_us']))
+    print('')
+    print('Mean API calls per request:')
+    for name in sorted(results):
+        print('  {}: {}'.format(name, ', '.join(
+            '{} {:.1f}'.format(rpc, count)
+            for rpc, count in sorted(results[name]['rpcs'].items()))))
+    regressions += compare_rpcs(results)
+    if args.update_baseline:
+        common.save_baseline(SECTION, results)
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
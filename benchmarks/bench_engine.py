@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""bench_engine.py - Microbenchmarks of the board engine hot paths:
+utils.evaluate, utils.parseState, utils.add_random_move and AI move
+selection in every mode, on a fixed set of positions.
+
+The modules without App Engine dependencies (ai, mnk, vectorized) are also
+measured directly; --core runs only those, without the SDK.
+
+Usage:
+    python benchmarks/bench_engine.py [--sdk PATH | --core] [--update-baseline]
+
+Results (p50/p95/p99 per call) are compared with benchmarks/baseline.json;
+the script exits with status 1 if any benchmark regressed."""
+
+import argparse
+import random
+import sys
+
+import common
+
+SECTION = 'engine'
+
+
+def positions(count, seed=1):
+    """Returns count reproducible mid-game 3x3 states with the AI to move"""
+    import mnk
+
+    rng = random.Random(seed)
+    states = []
+    while len(states) < count:
+        board = ['-'] * 9
+        for index in range(rng.choice((1, 3, 5))):
+            free = [cell for cell in range(9) if board[cell] == '-']
+            board[rng.choice(free)] = 'O' if index % 2 == 0 else 'X'
+        state = ''.join(board)
+        # The AI does not move in finished games.
+        if not mnk.evaluate(state):
+            states.append(state)
+    return states
+
+
+def large_positions(count, rows, cols, marks, seed=1):
+    rng = random.Random(seed)
+    states = []
+    for _ in range(count):
+        board = ['-'] * (rows * cols)
+        cells = rng.sample(range(rows * cols), 2 * marks + 1)
+        for index, cell in enumerate(cells):
+            board[cell] = 'O' if index % 2 == 0 else 'X'
+        states.append(''.join(board))
+    return states
+
+
+VARIANTS = ((4, 4, 4, 3), (5, 5, 4, 4), (15, 15, 5, 6))
+
+
+def run_core(repeat):
+    import ai
+    import mnk
+    import vectorized
+
+    states = positions(500)
+    args = [(state,) for state in states]
+    # Builds the perfect-play table outside the measurements.
+    ai.best_move(states[0])
+    results = {}
+    results['mnk.evaluate'] = common.summarize(
+        common.time_passes(mnk.evaluate, args, repeat))
+    results['ai.best_move'] = common.summarize(
+        common.time_passes(ai.best_move, args, repeat))
+    results['mnk.best_move.3x3'] = common.summarize(common.time_calls(
+        mnk.best_move, [(state, 3, 3, 3, 0.01) for state in states[:50]],
+        5))
+    results['vectorized.evaluate_many.500'] = common.summarize(
+        common.time_calls(vectorized.evaluate_many, [(states,)], repeat))
+    for rows, cols, win_length, marks in VARIANTS:
+        variant = '{}x{}/{}'.format(rows, cols, win_length)
+        large = large_positions(20, rows, cols, marks)
+        results['mnk.evaluate.' + variant] = common.summarize(
+            common.time_passes(mnk.evaluate,
+                               [(state, rows, cols, win_length)
+                                for state in large], repeat))
+    return results
+
+
+def run(repeat):
+    import utils
+
+    states = positions(500)
+    args = [(state,) for state in states]
+    results = {}
+    results['utils.evaluate'] = common.summarize(
+        common.time_passes(utils.evaluate, args, repeat))
+    results['utils.parseState'] = common.summarize(
+        common.time_passes(utils.parseState, args, repeat))
+    results['utils.add_random_move'] = common.summarize(
+        common.time_passes(utils.add_random_move, args, repeat))
+    results['utils.analyze'] = common.summarize(
+        common.time_passes(utils.analyze, args, repeat))
+    results['choose_ai_move.perfect'] = common.summarize(common.time_passes(
+        utils.choose_ai_move, [(state, 'perfect') for state in states],
+        repeat))
+    results['choose_ai_move.search.3x3'] = common.summarize(common.time_calls(
+        utils.choose_ai_move, [(state, 'search') for state in states[:50]]))
+    results['utils.evaluate_many.500'] = common.summarize(common.time_calls(
+        utils.evaluate_many, [(states,)], repeat))
+
+    for rows, cols, win_length, marks in VARIANTS:
+        variant = '{}x{}/{}'.format(rows, cols, win_length)
+        large = large_positions(20, rows, cols, marks)
+        results['utils.evaluate.' + variant] = common.summarize(
+            common.time_passes(utils.evaluate,
+                               [(state, rows, cols, win_length)
+                                for state in large], repeat))
+        results['choose_ai_move.search.' + variant] = common.summarize(
+            common.time_calls(utils.choose_ai_move,
+                              [(state, 'search', rows, cols, win_length)
+                               for state in large[:5]]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', help='Path to the App Engine SDK')
+    parser.add_argument('--core', action='store_true',
+                        help='Only the modules that do not need the SDK')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store these results as the new baseline')
+    args = parser.parse_args(argv)
+    if args.core:
+        common.setup_path()
+    else:
+        common.setup_sdk(args.sdk)
+
+    results = run_core(args.repeat)
+    if not args.core:
+        results.update(run(args.repeat))
+    print('{:<40} {:>12} {:>12} {:>8}'.format('benchmark', 'p50 (us)',
+                                              'baseline', 'change'))
+    regressions = common.compare(SECTION, results)
+    if args.update_baseline:
+        common.save_baseline(SECTION, results)
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
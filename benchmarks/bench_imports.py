@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""bench_imports.py - Startup cost of the application entry points.
+
+Each entry point (main.py for the cron and task handlers, api.py for the
+Endpoints API) is imported in a fresh interpreter, as on a cold instance,
+with every import timed. The total import time of each entry point is
+compared with benchmarks/baseline.json and the modules with the highest own
+import time (excluding the modules they import) are listed.
+
+Usage:
+    python benchmarks/bench_imports.py [--sdk PATH] [--runs N]
+        [--update-baseline]
+"""
+
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+
+import common
+
+SECTION = 'imports'
+ENTRY_POINTS = ('main', 'api')
+
+
+def _install_timer(stats):
+    """Wraps __import__ to add each module's own import time to stats"""
+    try:
+        import __builtin__ as builtins
+    except ImportError:
+        import builtins
+    original = builtins.__import__
+    timer = time.time
+    stack = []
+
+    def timed_import(name, *args, **kwargs):
+        fromlist = args[2] if len(args) > 2 else kwargs.get('fromlist')
+        if name in sys.modules and not fromlist:
+            return original(name, *args, **kwargs)
+        stack.append(0.0)
+        start = timer()
+        try:
+            return original(name, *args, **kwargs)
+        finally:
+            elapsed = timer() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            stats[name] += elapsed - children
+
+    builtins.__import__ = timed_import
+
+
+def child(module, sdk_path):
+    """Imports module with the import timer installed and prints the total
+    and per-module times as JSON"""
+    common.setup_sdk(sdk_path)
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    # Endpoints reads the app revision from the part after the dot.
+    bed.setup_env(overwrite=True, app_id='tictactoe-mj',
+                  current_version_id='1.1')
+
+    stats = collections.defaultdict(float)
+    _install_timer(stats)
+    start = time.time()
+    __import__(module)
+    total = time.time() - start
+    print(json.dumps({'total': total, 'modules': stats}))
+
+
+def measure(module, runs, sdk_path):
+    """Returns the total import times of module and the mean own time of
+    every module it imported, over runs fresh interpreters"""
+    totals = []
+    modules = collections.defaultdict(float)
+    command = [sys.executable, os.path.abspath(__file__), '--child', module]
+    if sdk_path:
+        command += ['--sdk', sdk_path]
+    for _ in range(runs):
+        output = subprocess.check_output(command, cwd=common.ROOT)
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        totals.append(result['total'])
+        for name, seconds in result['modules'].items():
+            modules[name] += seconds / runs
+    return totals, modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sdk', help='Path to the App Engine SDK')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15,
+                        help='Modules listed per entry point')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store these results as the new baseline')
+    args = parser.parse_args(argv)
+    if args.child:
+        return child(args.child, args.sdk)
+
+    results = {}
+    breakdowns = {}
+    for module in ENTRY_POINTS:
+        totals, breakdowns[module] = measure(module, args.runs, args.sdk)
+        results['import.' + module] = common.summarize(totals)
+    print('{:<40} {:>12} {:>12} {:>8}'.format('entry point', 'p50 (us)',
+                                              'baseline', 'change'))
+    regressions = common.compare(SECTION, results)
+    for module in ENTRY_POINTS:
+        print('')
+        print('Slowest imports of {} (own time, ms):'.format(module))
+        ranked = sorted(breakdowns[module].items(), key=lambda item: -item[1])
+        for name, seconds in ranked[:args.top]:
+            print('  {:<50} {:>8.2f}'.format(name, 1000 * seconds))
+    if args.update_baseline:
+        common.save_baseline(SECTION, results)
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
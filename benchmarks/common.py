@@ -0,0 +1,124 @@
+"""common.py - Shared helpers for the benchmark scripts: App Engine SDK
+setup, timing, percentiles and baseline comparison."""
+
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+# A result slower than the baseline by more than this fraction is reported
+# as a regression.
+TOLERANCE = 0.25
+
+
+def setup_path():
+    """Puts the project on sys.path"""
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def setup_sdk(sdk_path=None):
+    """Puts the project and the App Engine SDK on sys.path. The SDK is
+    located with sdk_path, the APPENGINE_SDK environment variable or the
+    dev_appserver.py found on PATH."""
+    setup_path()
+    sdk_path = sdk_path or os.environ.get('APPENGINE_SDK')
+    if not sdk_path:
+        for directory in os.environ.get('PATH', '').split(os.pathsep):
+            if os.path.exists(os.path.join(directory, 'dev_appserver.py')):
+                sdk_path = os.path.realpath(directory)
+                break
+    if sdk_path:
+        sys.path.insert(0, sdk_path)
+    try:
+        import dev_appserver
+    except ImportError:
+        sys.exit('App Engine SDK not found: pass --sdk or set APPENGINE_SDK')
+    dev_appserver.fix_sys_path()
+
+
+def percentile(samples, fraction):
+    """Returns the given percentile of a sorted list of samples"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+
+def summarize(samples):
+    """Returns latency statistics in microseconds for a list of seconds"""
+    samples = sorted(samples)
+    return {'count': len(samples),
+            'mean_us': 1e6 * sum(samples) / len(samples) if samples else 0.0,
+            'p50_us': 1e6 * percentile(samples, 0.50),
+            'p95_us': 1e6 * percentile(samples, 0.95),
+            'p99_us': 1e6 * percentile(samples, 0.99)}
+
+
+def time_calls(func, args_list, repeat=1):
+    """Calls func once per args tuple (repeat times over) and returns the
+    latency of each call in seconds"""
+    timer = time.time
+    samples = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = timer()
+            func(*args)
+            samples.append(timer() - start)
+    return samples
+
+
+def time_passes(func, args_list, repeat=1):
+    """Like time_calls, for calls faster than the timer resolution: times
+    each pass over args_list and returns the mean latency per call of every
+    pass"""
+    timer = time.time
+    samples = []
+    for _ in range(repeat):
+        start = timer()
+        for args in args_list:
+            func(*args)
+        samples.append((timer() - start) / len(args_list))
+    return samples
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE):
+        return {}
+    with open(BASELINE) as baseline:
+        return json.load(baseline)
+
+
+def save_baseline(section, results):
+    """Stores results as the baseline of one section (e.g. 'engine'),
+    keeping the baselines of the benchmarks that were not run"""
+    baseline = load_baseline()
+    baseline.setdefault(section, {}).update(results)
+    with open(BASELINE, 'w') as output:
+        json.dump(baseline, output, indent=2, sort_keys=True)
+        output.write('\n')
+
+
+def compare(section, results, key='p50_us'):
+    """Prints each result next to its baseline and returns the names of
+    the benchmarks that regressed or have no baseline"""
+    baseline = load_baseline().get(section, {})
+    regressions = []
+    for name in sorted(results):
+        current = results[name][key]
+        previous = baseline.get(name, {}).get(key)
+        line = '{:<40} {:>12.1f}'.format(name, current)
+        if previous is None:
+            regressions.append(name)
+            line += '  NO BASELINE'
+        elif previous:
+            change = (current - previous) / previous
+            line += ' {:>12.1f} {:>+8.1%}'.format(previous, change)
+            if change > TOLERANCE:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+    return regressions
@@ -0,0 +1,76 @@
+"""book.py - Precomputed move hints for every 3x3 position.
+
+book.bin holds a header followed by one 9 byte record per board, at the
+index of the board's Game.state read as a base-3 number ('-' = 0, 'O' = 1,
+'X' = 2, cell 0 first). Byte i rates a move on cell i for the player to move
+(the human moves first): 0xFF if the move is not possible, otherwise the
+outcome with perfect play in the high nibble (0 loss, 1 draw, 2 win) and
+the number of moves until the game ends, counting this one, in the low
+nibble.
+
+The file is generated ahead of time by make_book.py and memory-mapped at
+import, so nothing is computed when an instance starts and looking up a
+position is a single slice."""
+
+import collections
+import os
+
+MAGIC = b'TTTBOOK1'
+CELLS = 9
+POSITIONS = 3 ** CELLS
+ILLEGAL = 0xFF
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin')
+
+# Values are for the player to move: 1 win, 0 draw, -1 loss. Only their sign
+# matches GameHistoryForm.value, the ai.py value, which scales a win or loss
+# by the cells left empty.
+Hint = collections.namedtuple('Hint', 'move value distance')
+
+_DIGITS = {'-': 0, 'O': 1, 'X': 2}
+
+
+def index(state):
+    """Returns the record number of a 3x3 Game.state string, str or
+    unicode (as ndb returns it)"""
+    if len(state) != CELLS or not set(_DIGITS).issuperset(state):
+        raise ValueError('Invalid state {!r}'.format(state))
+    number = 0
+    for mark in state:
+        number = number * 3 + _DIGITS[mark]
+    return number
+
+
+def encode(value, distance):
+    return (value + 1) << 4 | distance
+
+
+def _load(path):
+    with open(path, 'rb') as source:
+        try:
+            import mmap
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ImportError, EnvironmentError):
+            # Not every runtime allows mmap; the file is small enough to read.
+            data = source.read()
+    if data[:len(MAGIC)] != MAGIC or \
+            len(data) != len(MAGIC) + POSITIONS * CELLS:
+        raise ValueError('{} is not a valid move book'.format(path))
+    return data
+
+# None until make_book.py has generated the file.
+_DATA = _load(PATH) if os.path.exists(PATH) else None
+
+
+def hints(state):
+    """Returns a Hint for every legal move of the player to move, best
+    first: wins before draws before losses, faster wins and slower losses
+    first. Finished games have no hints."""
+    if _DATA is None:
+        raise RuntimeError('{} is missing, run make_book.py'.format(PATH))
+    start = len(MAGIC) + index(state) * CELLS
+    hints = [Hint(move, (code >> 4) - 1, code & 0xF)
+             for move, code in enumerate(bytearray(_DATA[start:start + CELLS]))
+             if code != ILLEGAL]
+    hints.sort(key=lambda hint: (-hint.value, hint.distance
+                                 if hint.value > 0 else -hint.distance))
+    return hints
@@ -0,0 +1,74 @@
+"""counters.py - Sharded counter of the active (unfinished) games.
+
+Each change updates one randomly chosen shard, so concurrent game creation
+does not contend on a single entity. The total is cached in memcache and
+kept current with incr/decr, so reading it costs at most one get_multi of
+the shards.
+
+The shards only count the changes made since the counter was introduced,
+so the recount cron job (/tasks/cache_active_games) seeds the counter with
+the unfinished games and corrects any drift since."""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+SHARDS = 20
+MEMCACHE_ACTIVE_GAMES = 'ACTIVE_GAMES_COUNT'
+
+
+class ActiveGamesShard(ndb.Model):
+    """One shard of the active games counter"""
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def _shard_keys():
+    return [ndb.Key(ActiveGamesShard, str(index)) for index in range(SHARDS)]
+
+
+@ndb.transactional_tasklet
+def add_to_shard_async(delta):
+    """Adds delta to a random shard. Joins the current transaction if there
+    is one, so the change commits together with the caller's writes."""
+    index = str(random.randint(0, SHARDS - 1))
+    shard = yield ActiveGamesShard.get_by_id_async(index)
+    shard = shard or ActiveGamesShard(id=index)
+    shard.count += delta
+    yield shard.put_async()
+
+
+def add_to_shard(delta):
+    add_to_shard_async(delta).get_result()
+
+
+def update_cache(delta):
+    """Applies delta to the cached total, if it is cached"""
+    if delta > 0:
+        memcache.incr(MEMCACHE_ACTIVE_GAMES, delta)
+    elif delta < 0 and memcache.decr(MEMCACHE_ACTIVE_GAMES, -delta) == 0:
+        # decr stops at 0, so the cached total may no longer match the
+        # shards: read them again.
+        memcache.delete(MEMCACHE_ACTIVE_GAMES)
+
+
+def get_count():
+    """Returns the count of active games"""
+    count = memcache.get(MEMCACHE_ACTIVE_GAMES)
+    if count is None:
+        count = max(0, _shard_total())
+        memcache.add(MEMCACHE_ACTIVE_GAMES, count)
+    return count
+
+
+def _shard_total():
+    return sum(shard.count for shard in ndb.get_multi(_shard_keys())
+               if shard)
+
+
+def reset(count):
+    """Corrects the count of active games to count, e.g. after recounting
+    them. The difference is added to a shard like any other change, so
+    changes committed while it runs are kept."""
+    add_to_shard(count - _shard_total())
+    memcache.delete(MEMCACHE_ACTIVE_GAMES)
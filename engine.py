@@ -0,0 +1,84 @@
+"""engine.py - Bitboard representation of the Tic-tac-toe board.
+
+A board is stored as two 9-bit integers, one per player, where bit i is set
+when the player owns cell i:
+
+0|1|2
+- - -
+3|4|5
+- - -
+6|7|8
+
+Every 9-bit mask is precomputed against the 8 winning patterns once at import
+time, so checking a board for a winner is a single tuple lookup.
+This module has no App Engine dependencies so it can be used offline."""
+
+HUMAN = 'O'
+AI = 'X'
+EMPTY = '-'
+
+CELLS = 9
+FULL_MASK = (1 << CELLS) - 1
+EMPTY_STATE = EMPTY * CELLS
+
+WIN_PATTERNS = ((0, 1, 2), (3, 4, 5), (6, 7, 8),
+                (0, 3, 6), (1, 4, 7), (2, 5, 8),
+                (0, 4, 8), (2, 4, 6))
+WIN_MASKS = tuple(sum(1 << cell for cell in pattern)
+                  for pattern in WIN_PATTERNS)
+
+# _WINNING[mask] is True when the cells in mask contain a winning pattern.
+_WINNING = tuple(any(mask & win == win for win in WIN_MASKS)
+                 for mask in range(FULL_MASK + 1))
+_BITS = tuple(1 << cell for cell in range(CELLS))
+
+
+def from_state(state):
+    """Convert a Game.state string into a pair of (x, o) masks"""
+    if len(state) != CELLS:
+        raise ValueError('Invalid state length')
+    x = o = 0
+    for cell, mark in enumerate(state):
+        if mark == AI:
+            x |= _BITS[cell]
+        elif mark == HUMAN:
+            o |= _BITS[cell]
+        elif mark != EMPTY:
+            raise ValueError('Invalid mark {!r}'.format(mark))
+    return x, o
+
+
+def to_state(x, o):
+    """Convert a pair of (x, o) masks back into a Game.state string"""
+    return ''.join(AI if x & bit else HUMAN if o & bit else EMPTY
+                   for bit in _BITS)
+
+
+def is_win(mask):
+    """Return True if the cells in mask contain a winning pattern"""
+    return _WINNING[mask]
+
+
+def winner(x, o):
+    """Return 'O' or 'X' for the winning player, or None"""
+    if _WINNING[o]:
+        return HUMAN
+    if _WINNING[x]:
+        return AI
+    return None
+
+
+def is_full(x, o):
+    """Return True if there are no empty cells left"""
+    return x | o == FULL_MASK
+
+
+def is_draw(x, o):
+    """Return True if the board is full and nobody has won"""
+    return x | o == FULL_MASK and not _WINNING[x] and not _WINNING[o]
+
+
+def free_cells(x, o):
+    """Return the indices of the empty cells in ascending order"""
+    taken = x | o
+    return [cell for cell in range(CELLS) if not taken & _BITS[cell]]
@@ -0,0 +1,193 @@
+"""gamecache.py - Memcache-backed state of in-progress games.
+
+Moves are saved to memcache with compare-and-set, and the datastore write
+is deferred: the first unsaved move schedules a flush task, so all moves
+made until it runs (e.g. a human move and the AI reply) are persisted with
+a single put. Finished games are always written to the datastore by
+Game.end_game before the cache is updated.
+
+Every save increments Game.version. A save fails with ConflictException if
+the game changed since it was loaded, in memcache or in the datastore, so
+concurrent requests can never both apply a move; callers reload and retry.
+
+Each memcache value is a (dirty, entity) pair, where entity is the encoded
+Game protobuf and dirty means the datastore copy is behind."""
+
+import logging
+import time
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+from models import Game
+from utils import get_by_urlsafe
+
+CACHE_TIME = 3600
+# Seconds between the first unsaved move and its datastore write.
+FLUSH_DELAY = 30
+# Long polling: seconds a request waits for a change, and the interval
+# between checks, growing up to MAX_POLL_INTERVAL.
+WAIT_TIMEOUT = 20
+POLL_INTERVAL = 0.25
+MAX_POLL_INTERVAL = 2.0
+
+
+def _cache_key(urlsafe):
+    return 'game:' + urlsafe
+
+
+_adapter = ndb.ModelAdapter()
+
+
+def _encode(game):
+    return _adapter.entity_to_pb(game).Encode()
+
+
+def _decode(data):
+    return _adapter.pb_to_entity(entity_pb.EntityProto(data))
+
+
+class GameSession(object):
+    """Loads one game through memcache and saves it back with
+    compare-and-set. Use one session per attempt of a request. request_id,
+    if given, is recorded on the game by save."""
+
+    def __init__(self, urlsafe, request_id=None):
+        self.urlsafe = urlsafe
+        self.request_id = request_id
+        self._key = _cache_key(urlsafe)
+        self._client = memcache.Client()
+        self._cached = False
+        self._dirty = False
+        # Cache values as loaded and as last stored by this session.
+        self._loaded = None
+        self._stored = None
+
+    def load(self):
+        """Returns the game, or None if it does not exist"""
+        value = self._client.gets(self._key)
+        if value is not None:
+            self._cached = True
+            self._loaded = value
+            self._dirty, data = value
+            return _decode(data)
+        return get_by_urlsafe(self.urlsafe, Game)
+
+    def save(self, game, defer=True):
+        """Saves an in-progress game to memcache, deferring the datastore
+        write. Raises ConflictException if another request changed the game
+        since it was loaded. With defer=False no datastore write is made or
+        scheduled, because the caller writes the game itself (end_game)."""
+        game.version += 1
+        if self.request_id:
+            game.add_request_id(self.request_id)
+        value = (True, _encode(game))
+        if self._cached:
+            stored = self._client.cas(self._key, value, time=CACHE_TIME)
+        else:
+            stored = self._client.add(self._key, value, time=CACHE_TIME)
+        if not stored:
+            if self._client.get(self._key) is not None:
+                raise Conflict()
+            # Evicted or memcache is unavailable: write through instead.
+            logging.warning('Game cache unavailable, writing %s through',
+                            self.urlsafe)
+            if defer and not _persist(game):
+                raise Conflict()
+            return
+        self._cached = True
+        self._stored = value
+        if defer and not self._dirty:
+            schedule_flush(self.urlsafe)
+            self._dirty = True
+
+    def saved(self, game):
+        """Refreshes the cache after the game was written to the datastore"""
+        if not self._client.set(self._key, (False, _encode(game)),
+                                time=CACHE_TIME):
+            # Do not leave the unwritten game of save(defer=False) behind.
+            self._client.delete(self._key)
+
+    def undo(self, restore=True):
+        """Takes back a save(defer=False) whose datastore write failed,
+        unless another request changed the game since. With restore the
+        game is put back as loaded; otherwise it is dropped from the cache,
+        so the next load reads the datastore."""
+        if self._stored is None or \
+                self._client.gets(self._key) != self._stored:
+            return
+        if restore and self._loaded is not None:
+            self._client.cas(self._key, self._loaded, time=CACHE_TIME)
+        else:
+            self._client.delete(self._key)
+        self._stored = None
+
+
+class Conflict(endpoints.ConflictException):
+    """The game was changed by another request since it was loaded"""
+
+    def __init__(self):
+        super(Conflict, self).__init__(
+            'The game was changed by another request, please retry')
+
+
+def schedule_flush(urlsafe, countdown=FLUSH_DELAY):
+    taskqueue.add(url='/tasks/flush_game', params={'key': urlsafe},
+                  countdown=countdown)
+
+
+@ndb.transactional
+def _persist(game):
+    stored = game.key.get()
+    if stored is None or stored.game_over or stored.version >= game.version:
+        # Cancelled, ended or changed by another request.
+        return False
+    game.put()
+    return True
+
+
+def flush(urlsafe):
+    """Writes the cached game to the datastore if it has unsaved moves"""
+    client = memcache.Client()
+    key = _cache_key(urlsafe)
+    value = client.gets(key)
+    if value is None or not value[0]:
+        return
+    _persist(_decode(value[1]))
+    if not client.cas(key, (False, value[1]), time=CACHE_TIME):
+        # More moves were made meanwhile; they need their own flush.
+        schedule_flush(urlsafe)
+
+
+def forget(urlsafe):
+    """Drops a game from the cache, e.g. when it is cancelled"""
+    memcache.delete(_cache_key(urlsafe))
+
+
+def refresh(games):
+    """Replaces games loaded from the datastore with their cached state,
+    which may have moves that are not saved yet"""
+    if not games:
+        return games
+    keys = [_cache_key(game.key.urlsafe()) for game in games]
+    cached = memcache.get_multi(keys)
+    return [_decode(cached[key][1]) if key in cached else game
+            for key, game in zip(keys, games)]
+
+
+def wait_for_change(urlsafe, version, timeout=WAIT_TIMEOUT):
+    """Returns the game once its version is no longer version, or the
+    unchanged game after timeout seconds. Checks are served by memcache, so
+    waiting clients do not need to poll get_game."""
+    deadline = time.time() + timeout
+    delay = POLL_INTERVAL
+    while True:
+        game = GameSession(urlsafe).load()
+        if game is None or game.version != version or \
+                time.time() + delay >= deadline:
+            return game
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_INTERVAL)
@@ -0,0 +1,116 @@
+"""instrumentation.py - Per-endpoint latency and RPC instrumentation.
+
+Decorate an endpoint method with @instrumented (below @endpoints.method) to
+record, for every call, its wall time and the App Engine API calls it made
+(datastore gets, puts and queries, memcache, task queue, ...) with their
+request and response sizes. Each call is logged as one structured line and
+added to rolling per-instance aggregates returned by endpoint_stats."""
+
+import collections
+import functools
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+# Calls kept per endpoint for the rolling aggregates.
+WINDOW = 1000
+
+_local = threading.local()
+_lock = threading.Lock()
+_samples = collections.defaultdict(lambda: collections.deque(maxlen=WINDOW))
+
+
+def _byte_size(message):
+    try:
+        return message.ByteSize()
+    except Exception:
+        return 0
+
+
+def _record_rpc(service, call, request, response):
+    """apiproxy post-call hook: adds the call to the current record"""
+    record = getattr(_local, 'record', None)
+    if record is None:
+        return
+    name = '{}.{}'.format(service, call)
+    record['rpcs'][name] += 1
+    record['request_bytes'] += _byte_size(request)
+    record['response_bytes'] += _byte_size(response)
+
+
+def install():
+    """Registers the RPC hook. Safe to call more than once."""
+    hooks = apiproxy_stub_map.apiproxy.GetPostCallHooks()
+    hooks.Append('instrumentation', _record_rpc)
+
+install()
+
+
+def instrumented(method):
+    """Records latency and RPCs for each call of an endpoint method"""
+    @functools.wraps(method)
+    def wrapper(service, request):
+        _local.record = record = {'rpcs': collections.Counter(),
+                                  'request_bytes': 0,
+                                  'response_bytes': 0}
+        start = time.time()
+        status = 'ok'
+        try:
+            return method(service, request)
+        except Exception as e:
+            status = e.__class__.__name__
+            raise
+        finally:
+            _local.record = None
+            record['endpoint'] = method.__name__
+            record['status'] = status
+            record['ms'] = round(1000 * (time.time() - start), 3)
+            with _lock:
+                _samples[method.__name__].append(record)
+            logging.info('endpoint_stats %s', json.dumps(record,
+                                                        sort_keys=True))
+    return wrapper
+
+
+def _percentile(values, fraction):
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def endpoint_stats():
+    """Returns the rolling aggregates of every endpoint called on this
+    instance, as a list of dicts sorted by name"""
+    with _lock:
+        samples = dict((name, list(records))
+                       for name, records in _samples.items())
+    stats = []
+    for name in sorted(samples):
+        records = samples[name]
+        latencies = sorted(record['ms'] for record in records)
+        rpcs = collections.Counter()
+        for record in records:
+            rpcs.update(record['rpcs'])
+        count = len(records)
+        stats.append({
+            'endpoint': name,
+            'count': count,
+            'errors': sum(1 for record in records if record['status'] != 'ok'),
+            'p50_ms': _percentile(latencies, 0.50),
+            'p95_ms': _percentile(latencies, 0.95),
+            'p99_ms': _percentile(latencies, 0.99),
+            'rpcs': dict((rpc, float(total) / count)
+                         for rpc, total in rpcs.items()),
+            'request_bytes': float(sum(record['request_bytes']
+                                       for record in records)) / count,
+            'response_bytes': float(sum(record['response_bytes']
+                                        for record in records)) / count,
+        })
+    return stats
+
+
+def reset():
+    with _lock:
+        _samples.clear()
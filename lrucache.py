@@ -0,0 +1,50 @@
+"""lrucache.py - A bounded, thread-safe LRU cache with per-entry expiry.
+
+App Engine instances serve requests on several threads (threadsafe: yes), so
+every operation takes a lock."""
+
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """Keeps at most max_size entries, each for at most ttl seconds"""
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return default
+            # Re-insert to mark the entry as most recently used.
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
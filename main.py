@@ -1,47 +1,152 @@
 #!/usr/bin/env python
 
 """main.py - This file contains handlers that are called by taskqueue and/or
-cronjobs."""
+cronjobs. It does not import the Endpoints API, so instances serving only
+these handlers do not load it."""
+import collections
 import logging
+from datetime import date
 
 import webapp2
-from google.appengine.api import mail, app_identity
-from api import TicTacToeApi
+from google.appengine.api import mail, app_identity, taskqueue
+from google.appengine.ext import ndb
 
+import counters
+import transfer
 from models import User, Game, Score
 
 
+# Games read per reminder task. All games of the last user in a batch are
+# included as well, so every user gets exactly one digest.
+REMINDER_BATCH_SIZE = 200
+
+
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User with an email about games.
+        """Start the reminder email pipeline for users with unfinished games.
         Called every day using a cron job"""
-        app_id = app_identity.get_application_id()
-        games = Game.query(Game.game_over == False)
+        _queue_reminder_batch(date.today().isoformat(), 0)
+
+
+class SendReminderBatch(webapp2.RequestHandler):
+    def post(self):
+        """Send one digest email per user for a batch of unfinished games,
+        then chain the task for the next batch."""
+        run = self.request.get('run')
+        batch = int(self.request.get('batch', 0))
+        cursor = self.request.get('cursor')
+        skip_user = self.request.get('skip_user')
+        skip_user = ndb.Key(urlsafe=skip_user) if skip_user else None
+
+        # Ordered by user so each user's games are next to each other.
+        query = Game.query(Game.game_over == False).order(Game.user)
+        games, next_cursor, more = query.fetch_page(
+            REMINDER_BATCH_SIZE,
+            start_cursor=ndb.Cursor(urlsafe=cursor) if cursor else None)
+
+        games_by_user = collections.OrderedDict()
         for game in games:
-            user = game.user.get()
-            safekey = game.key.urlsafe()
-            subject = '{}, You have unfinished game!'.format(user.name)
-            body = """
-            Hello {}, you have unfinished game!\n
-            Click https://tictactoe-mj.appspot.com/game/{} to access the game
-            """.format(user.name, safekey)
-            # This will send test emails, the arguments to send_mail are:
-            # from, to, subject, body
-            mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                           user.email,
-                           subject,
-                           body)
-            
+            if game.user != skip_user:
+                games_by_user.setdefault(game.user, []).append(game.key)
+        if more and games:
+            # The last user's games may continue into the next batch: send
+            # them all now and skip that user in the next batch.
+            skip_user = games[-1].user
+            if skip_user in games_by_user:
+                games_by_user[skip_user] = Game.query(
+                    Game.game_over == False,
+                    Game.user == skip_user).fetch(keys_only=True)
+
+        app_id = app_identity.get_application_id()
+        users = ndb.get_multi(games_by_user.keys())
+        for user, game_keys in zip(users, games_by_user.values()):
+            if user and user.email:
+                _send_digest(app_id, user, game_keys)
+
+        if more and next_cursor:
+            _queue_reminder_batch(run, batch + 1, next_cursor.urlsafe(),
+                                  skip_user.urlsafe())
+        self.response.set_status(204)
+
+
+def _queue_reminder_batch(run, batch, cursor='', skip_user=''):
+    """Queue one reminder batch. Tasks are named by run and batch number so
+    a retried task does not start a second chain."""
+    try:
+        taskqueue.add(url='/tasks/send_reminders',
+                      name='reminders-{}-{}'.format(run, batch),
+                      params={'run': run, 'batch': batch, 'cursor': cursor,
+                              'skip_user': skip_user})
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info('Reminder batch %s of %s already queued', batch, run)
+
+
+def _send_digest(app_id, user, game_keys):
+    """Send one email listing all of a user's unfinished games"""
+    subject = '{}, You have unfinished game!'.format(user.name)
+    links = '\n'.join(
+        'Click https://tictactoe-mj.appspot.com/game/{} to access the game'
+        .format(key.urlsafe()) for key in game_keys)
+    body = """
+    Hello {}, you have {} unfinished game(s)!\n
+    {}
+    """.format(user.name, len(game_keys), links)
+    # This will send test emails, the arguments to send_mail are:
+    # from, to, subject, body
+    mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
+                   user.email,
+                   subject,
+                   body)
+
 
 class UpdateActiveGames(webapp2.RequestHandler):
+    def get(self):
+        """Recount the active games and correct the sharded counter. Run
+        daily by cron, which also seeds the counter after a deploy."""
+        counters.reset(Game.query(Game.game_over == False).count())
+        self.response.set_status(204)
+
+    post = get
+
+
+class FlushGame(webapp2.RequestHandler):
     def post(self):
-        """Update count of active games announcement in memcache."""
-        TicTacToeApi._cache_active_games()
+        """Write a cached game's unsaved moves to the datastore"""
+        import gamecache
+        gamecache.flush(self.request.get('key'))
         self.response.set_status(204)
 
 
+class StartExport(webapp2.RequestHandler):
+    def get(self):
+        """Start exporting every User, Game, Score and GameHistory to Cloud
+        Storage"""
+        self.response.write(transfer.start_export())
+
+
+class StartImport(webapp2.RequestHandler):
+    def post(self):
+        """Start importing the export in the Cloud Storage directory given
+        as path"""
+        path = self.request.get('path')
+        if not path:
+            self.abort(400, 'path is required')
+        self.response.write(transfer.start_import(path))
+
+
+class TransferChunk(webapp2.RequestHandler):
+    def post(self):
+        """Export or import one chunk of a transfer job"""
+        transfer.run_chunk(self.request.get('job'))
+        self.response.set_status(204)
+
 
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    ('/tasks/send_reminders', SendReminderBatch),
     ('/tasks/cache_active_games', UpdateActiveGames),
+    ('/tasks/flush_game', FlushGame),
+    ('/admin/export', StartExport),
+    ('/admin/import', StartImport),
+    ('/tasks/transfer', TransferChunk),
 ], debug=True)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""make_book.py - Generates book.bin, the move hint table read by book.py.
+
+Every legal move of every position is rated with the perfect-play table of
+ai.py, which uses the same board encoding and win logic as utils.evaluate.
+Run it again whenever the file format or the rules change.
+
+Usage:
+    python make_book.py [--output book.bin]
+"""
+
+import argparse
+import itertools
+import os
+
+import ai
+import book
+import engine
+
+
+def _record(state):
+    """Returns the 9 byte record of one position"""
+    record = bytearray([book.ILLEGAL] * book.CELLS)
+    humans, ais = state.count(engine.HUMAN), state.count(engine.AI)
+    if humans == ais:
+        mark = engine.HUMAN
+    elif humans == ais + 1:
+        mark = engine.AI
+    else:
+        return record
+    x, o = engine.from_state(state)
+    if engine.winner(x, o) or engine.is_full(x, o):
+        return record
+    me, opp = (x, o) if mark == engine.AI else (o, x)
+    try:
+        ai.lookup(me, opp)
+    except ValueError:
+        return record
+    free = engine.free_cells(me, opp)
+    for cell in free:
+        # ai values are 1 + the empty cells left when the game is won, so
+        # they also give the number of moves until it ends.
+        value = -ai.lookup(opp, me | 1 << cell)[0]
+        if value > 0:
+            record[cell] = book.encode(1, len(free) - value + 1)
+        elif value < 0:
+            record[cell] = book.encode(-1, len(free) + value + 1)
+        else:
+            record[cell] = book.encode(0, len(free))
+    return record
+
+
+def build():
+    """Returns the contents of the book file"""
+    data = bytearray(book.MAGIC)
+    for cells in itertools.product('-OX', repeat=book.CELLS):
+        data.extend(_record(''.join(cells)))
+    return bytes(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', default=book.PATH)
+    args = parser.parse_args(argv)
+    # book.py maps the existing file on import; write a new one beside it.
+    with open(args.output + '.tmp', 'wb') as output:
+        output.write(build())
+    os.rename(args.output + '.tmp', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""matchmaking.py - Pairs users for two-player games.
+
+A user asking for a match is paired with the longest waiting user of the
+closest rankingscore band (see matchqueue.py), and the game is created
+right away. Otherwise the request long-polls until another user picks it,
+up to MATCH_TIMEOUT seconds. A request that timed out leaves the queue,
+and the client asks again.
+
+On the development server the queue is a matchqueue.LocalQueue. In
+production it is a DatastoreQueue: waiting users are WaitingPlayer
+entities, found with an indexed query per band and claimed in a
+transaction, so every instance shares one queue."""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+from google.appengine.ext import ndb
+
+import matchqueue
+from gamecache import POLL_INTERVAL, MAX_POLL_INTERVAL
+from models import Game
+
+# Seconds a find_match request waits for an opponent.
+MATCH_TIMEOUT = 20
+# Oldest waiting users fetched per band by DatastoreQueue.join.
+CANDIDATES = 5
+
+
+class WaitingPlayer(ndb.Model):
+    """A user in the matchmaking queue, keyed by the urlsafe User key"""
+    band = ndb.IntegerProperty(required=True)
+    joined = ndb.DateTimeProperty(auto_now_add=True)
+    # Set when another user paired with this one, then game is recorded.
+    paired = ndb.BooleanProperty(default=False)
+    paired_at = ndb.DateTimeProperty(indexed=False)
+    game = ndb.KeyProperty(kind='Game', indexed=False)
+
+
+def _waiting_key(player):
+    return ndb.Key(WaitingPlayer, player.urlsafe())
+
+
+def _paired(waiting):
+    """True if the waiting user was paired and the game may still come.
+    A pairing without a game after PAIR_TIMEOUT seconds is given up."""
+    if not waiting or not waiting.paired:
+        return False
+    paired_at = waiting.paired_at or waiting.joined
+    return bool(waiting.game) or datetime.utcnow() - paired_at < \
+        timedelta(seconds=matchqueue.PAIR_TIMEOUT)
+
+
+@ndb.transactional(xg=True)
+def _pair(own_key, opponent_key):
+    own, opponent = ndb.get_multi([own_key, opponent_key])
+    if _paired(own) or not opponent or opponent.paired:
+        # One of them was paired by another request meanwhile.
+        return False
+    if own:
+        own_key.delete()
+    opponent.paired = True
+    opponent.paired_at = datetime.utcnow()
+    opponent.put()
+    return True
+
+
+def _expired(waiting):
+    """True if the user waited longer than ENTRY_TIMEOUT seconds unpaired"""
+    return not waiting.paired and datetime.utcnow() - waiting.joined > \
+        timedelta(seconds=matchqueue.ENTRY_TIMEOUT)
+
+
+@ndb.transactional
+def _enqueue(key, player_band):
+    waiting = key.get()
+    if not waiting or _expired(waiting) or \
+            (waiting.paired and not _paired(waiting)):
+        WaitingPlayer(key=key, band=player_band).put()
+
+
+@ndb.transactional
+def _leave(key):
+    waiting = key.get()
+    if not waiting or _paired(waiting):
+        return False
+    key.delete()
+    return True
+
+
+class DatastoreQueue(matchqueue.MatchQueue):
+    """MatchQueue kept in the datastore"""
+
+    def join(self, player, rankingscore):
+        own_key = _waiting_key(player)
+        cutoff = datetime.utcnow() - timedelta(
+            seconds=matchqueue.ENTRY_TIMEOUT)
+        for candidate_band in matchqueue.search_bands(rankingscore):
+            candidates = WaitingPlayer.query(
+                WaitingPlayer.band == candidate_band,
+                WaitingPlayer.paired == False,
+                WaitingPlayer.joined > cutoff)\
+                .order(WaitingPlayer.joined)\
+                .fetch(CANDIDATES, keys_only=True)
+            for key in candidates:
+                if key != own_key and _pair(own_key, key):
+                    return ndb.Key(urlsafe=key.id())
+        _enqueue(own_key, matchqueue.band(rankingscore))
+        return None
+
+    def notify(self, player, game):
+        waiting = _waiting_key(player).get()
+        waiting.game = game
+        waiting.put()
+
+    def match(self, player):
+        key = _waiting_key(player)
+        waiting = key.get()
+        if not waiting or not waiting.game:
+            return None
+        key.delete()
+        return waiting.game
+
+    def leave(self, player):
+        return _leave(_waiting_key(player))
+
+
+if os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+    queue = matchqueue.LocalQueue()
+else:
+    queue = DatastoreQueue()
+
+
+def find_match(user, timeout=MATCH_TIMEOUT):
+    """Returns a new two-player Game for the user, or None if no opponent
+    was found within timeout seconds. The user who waited longer moves
+    first."""
+    game_key = queue.match(user.key)
+    if game_key:
+        return game_key.get()
+    opponent = queue.join(user.key, user.rankingscore)
+    if opponent:
+        game = Game.new_game(opponent, ai_mode=None, opponent=user.key)
+        queue.notify(opponent, game.key)
+        return game
+    deadline = time.time() + timeout
+    delay = POLL_INTERVAL
+    while time.time() + delay < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_INTERVAL)
+        game_key = queue.match(user.key)
+        if game_key:
+            return game_key.get()
+    if queue.leave(user.key):
+        return None
+    # Paired meanwhile: the game may already be recorded, otherwise the
+    # next request gets it.
+    game_key = queue.match(user.key)
+    return game_key.get() if game_key else None
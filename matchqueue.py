@@ -0,0 +1,163 @@
+"""matchqueue.py - Matchmaking queue interface and its in-memory backend.
+
+Waiting players are bucketed by rankingscore band, so finding an opponent
+looks at a few buckets (the player's own band first, then the neighbouring
+ones) and takes the player who has waited longest, without scanning the
+queue. Pairing removes the opponent from the queue atomically; the player
+who started the game then records it with notify, and the opponent picks it
+up with match. If no game is recorded within PAIR_TIMEOUT seconds (the
+request that paired them failed), the opponent may join or leave again.
+Players waiting for more than ENTRY_TIMEOUT seconds are no longer paired:
+their request gave up without leaving the queue.
+
+LocalQueue keeps the queue in process memory, so it only pairs players
+served by the same instance. It is used on the development server and
+offline; matchmaking.DatastoreQueue implements the same interface for
+production. This module has no App Engine dependencies."""
+
+import collections
+import threading
+import time
+
+# Width of a rankingscore band, and how many bands away an opponent may be.
+BAND_WIDTH = 25
+MAX_BAND_DISTANCE = 1
+# Seconds after which a pairing without a game is given up: the request
+# deadline of the pairing request.
+PAIR_TIMEOUT = 60
+# Seconds after which a waiting player is considered gone.
+ENTRY_TIMEOUT = 60
+
+
+def band(rankingscore):
+    """Returns the band of a rankingscore"""
+    return rankingscore // BAND_WIDTH
+
+
+def search_bands(rankingscore):
+    """Returns the bands to look for opponents in, closest first"""
+    own = band(rankingscore)
+    bands = [own]
+    for distance in range(1, MAX_BAND_DISTANCE + 1):
+        bands += [own - distance, own + distance]
+    return [candidate for candidate in bands if candidate >= 0]
+
+
+class MatchQueue(object):
+    """Interface of the matchmaking queue backends. Players are identified
+    by their User key, games by their Game key."""
+
+    def join(self, player, rankingscore):
+        """Pairs the player with the longest waiting player of the closest
+        band and returns that opponent, removing both from the queue. If
+        there is none, queues the player (keeping its place if it is
+        already waiting) and returns None."""
+        raise NotImplementedError
+
+    def notify(self, player, game):
+        """Records the game started for a player that join paired"""
+        raise NotImplementedError
+
+    def match(self, player):
+        """Returns the game recorded for the player by notify, once, or None
+        while the player is waiting"""
+        raise NotImplementedError
+
+    def leave(self, player):
+        """Removes a waiting player from the queue. Returns False if the
+        player was not waiting, e.g. because it was just paired."""
+        raise NotImplementedError
+
+
+class LocalQueue(MatchQueue):
+    """In-memory MatchQueue, shared by the threads of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # band -> waiting player -> time joined, in the order they joined
+        self._bands = collections.defaultdict(collections.OrderedDict)
+        # waiting player -> band
+        self._waiting = {}
+        # paired player -> game, None until notify
+        self._games = {}
+        # paired player -> time of the pairing, until notify
+        self._paired_at = {}
+
+    def join(self, player, rankingscore):
+        with self._lock:
+            if player in self._games:
+                if not self._pairing_expired(player):
+                    # Already paired; the game is returned by match.
+                    return None
+                self._forget_pairing(player)
+            self._expire(time.time() - ENTRY_TIMEOUT)
+            for candidate_band in search_bands(rankingscore):
+                waiting = self._bands.get(candidate_band)
+                if not waiting:
+                    continue
+                for opponent in waiting:
+                    if opponent != player:
+                        self._remove(opponent)
+                        self._remove(player)
+                        self._games[opponent] = None
+                        self._paired_at[opponent] = time.time()
+                        return opponent
+            if player not in self._waiting:
+                own = band(rankingscore)
+                self._bands[own][player] = time.time()
+                self._waiting[player] = own
+            return None
+
+    def notify(self, player, game):
+        with self._lock:
+            self._games[player] = game
+            self._paired_at.pop(player, None)
+
+    def match(self, player):
+        with self._lock:
+            if self._games.get(player) is None:
+                return None
+            return self._games.pop(player)
+
+    def leave(self, player):
+        with self._lock:
+            if self._pairing_expired(player):
+                self._forget_pairing(player)
+                return True
+            return self._remove(player)
+
+    def __len__(self):
+        """Returns the number of waiting players"""
+        with self._lock:
+            return len(self._waiting)
+
+    def _expire(self, cutoff):
+        """Removes the players who joined before cutoff"""
+        for player_band in list(self._bands):
+            expired = []
+            for waiting, joined in self._bands[player_band].items():
+                if joined >= cutoff:
+                    break
+                expired.append(waiting)
+            for waiting in expired:
+                self._remove(waiting)
+
+    def _remove(self, player):
+        player_band = self._waiting.pop(player, None)
+        if player_band is None:
+            return False
+        waiting = self._bands[player_band]
+        del waiting[player]
+        if not waiting:
+            del self._bands[player_band]
+        return True
+
+    def _pairing_expired(self, player):
+        """True if the player was paired but no game was recorded in time"""
+        paired_at = self._paired_at.get(player)
+        return paired_at is not None and \
+            time.time() - paired_at > PAIR_TIMEOUT
+
+    def _forget_pairing(self, player):
+        self._games.pop(player, None)
+        self._paired_at.pop(player, None)
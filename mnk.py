@@ -0,0 +1,322 @@
+"""mnk.py - Board engine and AI for m,n,k games.
+
+An m,n,k game is played on a board with `rows` x `cols` cells where the first
+player to get `win_length` marks in a row (horizontally, vertically or
+diagonally) wins: Tic-tac-toe is the 3,3,3 game and gomoku is the 15,15,5
+game. Boards use the same Game.state string encoding as engine.py, with
+cells numbered row by row, and are searched as one integer mask per player.
+
+Exhaustive solving does not scale past 3x3, so the AI uses depth-limited
+alpha-beta search with move ordering and a Zobrist-hashed transposition
+table, deepened iteratively until the per-request time budget runs out.
+This module has no App Engine dependencies so it can be used offline."""
+
+import random
+import time
+
+import engine
+from lrucache import LRUCache
+
+HUMAN = 'O'
+AI = 'X'
+EMPTY = '-'
+
+MIN_SIZE = 3
+MAX_SIZE = 15
+
+WIN_SCORE = 1 << 30
+# Heuristic weight of an open line holding n marks of a single player.
+_WEIGHTS = (0, 1, 8, 64, 512, 4096, 32768, 262144)
+
+_EXACT, _LOWER, _UPPER = 0, 1, 2
+# The transposition table, shared by every variant, is cleared once it grows
+# past this many entries (about 250 bytes each).
+MAX_TABLE_ENTRIES = 50000
+# Variants kept by variant(), least recently used first out.
+MAX_VARIANTS = 16
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+
+class Variant(object):
+    """Precomputed geometry of one board size and win length"""
+
+    def __init__(self, rows, cols, win_length):
+        if not (MIN_SIZE <= rows <= MAX_SIZE and MIN_SIZE <= cols <= MAX_SIZE):
+            raise ValueError('Board size must be between {} and {}'.format(
+                MIN_SIZE, MAX_SIZE))
+        if not MIN_SIZE <= win_length <= max(rows, cols):
+            raise ValueError('Invalid win length')
+        self.rows = rows
+        self.cols = cols
+        self.win_length = win_length
+        self.cells = rows * cols
+        self.full_mask = (1 << self.cells) - 1
+        self.bits = tuple(1 << cell for cell in range(self.cells))
+
+        lines = []
+        for row in range(rows):
+            for col in range(cols):
+                for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_row = row + d_row * (win_length - 1)
+                    end_col = col + d_col * (win_length - 1)
+                    if 0 <= end_row < rows and 0 <= end_col < cols:
+                        lines.append(sum(
+                            self.bits[(row + d_row * i) * cols + col + d_col * i]
+                            for i in range(win_length)))
+        self.lines = tuple(lines)
+        self.lines_through = tuple(
+            tuple(line for line in lines if line & bit) for bit in self.bits)
+
+        # Cells within two steps of each cell, used to prune far-away moves
+        # on large boards.
+        neighbours = []
+        for cell in range(self.cells):
+            row, col = divmod(cell, cols)
+            neighbours.append(sum(
+                self.bits[r * cols + c]
+                for r in range(max(0, row - 2), min(rows, row + 3))
+                for c in range(max(0, col - 2), min(cols, col + 3))))
+        self.neighbours = tuple(neighbours)
+
+        # Cells ordered from the centre outwards.
+        centre_row, centre_col = (rows - 1) / 2.0, (cols - 1) / 2.0
+        self.centre_order = tuple(sorted(
+            range(self.cells),
+            key=lambda cell: (abs(cell // cols - centre_row) +
+                              abs(cell % cols - centre_col), cell)))
+
+        rng = random.Random(rows * 10000 + cols * 100 + win_length)
+        self.zobrist = tuple((rng.getrandbits(64), rng.getrandbits(64))
+                             for _ in range(self.cells))
+        self.zobrist_side = rng.getrandbits(64)
+        # Starts every hash, so positions of different variants (such as
+        # their empty boards) do not share transposition table entries.
+        self.zobrist_variant = rng.getrandbits(64)
+
+    def from_state(self, state):
+        """Convert a Game.state string into a pair of (x, o) masks"""
+        if len(state) != self.cells:
+            raise ValueError('Invalid state length')
+        x = o = 0
+        for cell, mark in enumerate(state):
+            if mark == AI:
+                x |= self.bits[cell]
+            elif mark == HUMAN:
+                o |= self.bits[cell]
+            elif mark != EMPTY:
+                raise ValueError('Invalid mark {!r}'.format(mark))
+        return x, o
+
+    def to_state(self, x, o):
+        """Convert a pair of (x, o) masks back into a Game.state string"""
+        return ''.join(AI if x & bit else HUMAN if o & bit else EMPTY
+                       for bit in self.bits)
+
+    def is_win(self, mask):
+        """Return True if the cells in mask contain a winning line"""
+        for line in self.lines:
+            if mask & line == line:
+                return True
+        return False
+
+    def wins_at(self, mask, cell):
+        """Return True if mask has a winning line through cell"""
+        for line in self.lines_through[cell]:
+            if mask & line == line:
+                return True
+        return False
+
+    def winner(self, x, o):
+        """Return 'O' or 'X' for the winning player, or None"""
+        if self.is_win(o):
+            return HUMAN
+        if self.is_win(x):
+            return AI
+        return None
+
+    def hash(self, x, o):
+        """Return the Zobrist hash of the position"""
+        h = self.zobrist_variant
+        for cell in range(self.cells):
+            if x & self.bits[cell]:
+                h ^= self.zobrist[cell][0]
+            elif o & self.bits[cell]:
+                h ^= self.zobrist[cell][1]
+        return h
+
+_VARIANTS = LRUCache(max_size=MAX_VARIANTS, ttl=3600)
+# Zobrist hash -> (depth, flag, value, best move), see AlphaBetaSearch.
+_TABLE = {}
+
+
+def variant(rows=3, cols=3, win_length=3):
+    """Return the cached Variant for the board size and win length"""
+    key = (rows, cols, win_length)
+    result = _VARIANTS.get(key)
+    if result is None:
+        result = Variant(rows, cols, win_length)
+        _VARIANTS.set(key, result)
+    return result
+
+
+def evaluate(state, rows=3, cols=3, win_length=3):
+    """Return the winning mark ('O' or 'X') of the state, or None"""
+    if (rows, cols, win_length) == (3, 3, 3):
+        return engine.winner(*engine.from_state(state))
+    board = variant(rows, cols, win_length)
+    return board.winner(*board.from_state(state))
+
+
+class AlphaBetaSearch(object):
+    """Iterative-deepening alpha-beta search bounded by a time budget.
+
+    The transposition table is shared by every search served by this
+    instance, whatever the variant, and bounded by MAX_TABLE_ENTRIES."""
+
+    def __init__(self, board, time_budget, max_depth=None):
+        self.board = board
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.table = _TABLE
+        if len(self.table) > MAX_TABLE_ENTRIES:
+            self.table.clear()
+        self.nodes = 0
+        self.depth_reached = 0
+        self._deadline = None
+
+    def _candidates(self, me, opp):
+        board = self.board
+        taken = me | opp
+        if board.cells <= 16:
+            near = board.full_mask
+        else:
+            near = 0
+            for cell in range(board.cells):
+                if taken & board.bits[cell]:
+                    near |= board.neighbours[cell]
+        return [cell for cell in board.centre_order
+                if near & board.bits[cell] and not taken & board.bits[cell]]
+
+    def _order(self, moves, me, opp, first):
+        """Order moves by how many open lines they extend or block"""
+        lines_through = self.board.lines_through
+
+        def score(cell):
+            if cell == first:
+                return -1 << 40
+            total = 0
+            for line in lines_through[cell]:
+                mine, theirs = me & line, opp & line
+                if not theirs:
+                    total += _WEIGHTS[_popcount(mine)]
+                if not mine:
+                    total += _WEIGHTS[_popcount(theirs)]
+            return -total
+        moves.sort(key=score)
+        return moves
+
+    def _evaluate(self, me, opp):
+        """Static evaluation for the player to move"""
+        score = 0
+        for line in self.board.lines:
+            mine, theirs = me & line, opp & line
+            if mine and not theirs:
+                score += _WEIGHTS[_popcount(mine)]
+            elif theirs and not mine:
+                score -= _WEIGHTS[_popcount(theirs)]
+        return score
+
+    def _negamax(self, me, opp, h, side, depth, ply, alpha, beta):
+        self.nodes += 1
+        if time.time() > self._deadline:
+            raise _Timeout()
+        board = self.board
+        original_alpha = alpha
+        entry = self.table.get(h)
+        first = None
+        if entry is not None:
+            entry_depth, flag, value, first = entry
+            if entry_depth >= depth:
+                if flag == _EXACT:
+                    return value
+                if flag == _LOWER:
+                    alpha = max(alpha, value)
+                elif flag == _UPPER:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+        moves = self._candidates(me, opp)
+        if not moves:
+            return 0
+        if depth == 0:
+            return self._evaluate(me, opp)
+
+        best_value, best_move = -WIN_SCORE - 1, moves[0]
+        for cell in self._order(moves, me, opp, first):
+            bit = board.bits[cell]
+            if board.wins_at(me | bit, cell):
+                value = WIN_SCORE - ply
+            else:
+                child = h ^ board.zobrist[cell][side] ^ board.zobrist_side
+                value = -self._negamax(opp, me | bit, child, 1 - side,
+                                       depth - 1, ply + 1, -beta, -alpha)
+            if value > best_value:
+                best_value, best_move = value, cell
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            flag = _UPPER
+        elif best_value >= beta:
+            flag = _LOWER
+        else:
+            flag = _EXACT
+        self.table[h] = (depth, flag, best_value, best_move)
+        return best_value
+
+    def best_move(self, x, o, mark=AI):
+        """Return the best cell for mark to play found within the budget"""
+        board = self.board
+        me, opp = (x, o) if mark == AI else (o, x)
+        side = 0 if mark == AI else 1
+        moves = self._candidates(me, opp)
+        if not moves:
+            raise ValueError('Game already over')
+        h = board.hash(x, o)
+        if side:
+            h ^= board.zobrist_side
+        self._deadline = time.time() + self.time_budget
+        max_depth = len(moves) if self.max_depth is None \
+            else min(self.max_depth, len(moves))
+        best = self._order(moves, me, opp, None)[0]
+        for depth in range(1, max_depth + 1):
+            try:
+                value = self._negamax(me, opp, h, side, depth, 0,
+                                      -WIN_SCORE - 1, WIN_SCORE + 1)
+            except _Timeout:
+                break
+            # Another thread may have cleared the table meanwhile.
+            entry = self.table.get(h)
+            if entry is not None:
+                best = entry[3]
+            self.depth_reached = depth
+            if abs(value) >= WIN_SCORE - board.cells:
+                # A forced result was found, searching deeper will not help.
+                break
+        return best
+
+
+def best_move(state, rows=3, cols=3, win_length=3, time_budget=0.5,
+              mark=AI):
+    """Return the best cell for mark to play in the given state"""
+    board = variant(rows, cols, win_length)
+    x, o = board.from_state(state)
+    return AlphaBetaSearch(board, time_budget).best_move(x, o, mark)
@@ -7,69 +7,326 @@ from datetime import date
 from protorpc import messages
 from google.appengine.ext import ndb
 
+import counters
+from lrucache import LRUCache
 
 
 
+
+# Instance-level caches, shared by every request served by this instance.
+# User names never change, so a cached name -> key mapping only goes stale
+# when a user is created; cached User entities are only used for display and
+# may lag behind the ranking counters by up to the TTL.
+_user_keys = LRUCache(max_size=5000, ttl=600)
+_users = LRUCache(max_size=5000, ttl=60)
+
+
+# Ranking points per game result. The final score is based on both
+# performance and participation.
+RANKING_POINTS = {'Win': 5, 'Draw': 3, 'Lose': 1}
+# The result of a game for the other player of a two-player game.
+OPPOSITE_RESULT = {'Win': 'Lose', 'Draw': 'Draw', 'Lose': 'Win'}
+
+# Idempotency keys of the most recent move requests kept on each Game.
+REQUEST_ID_HISTORY = 10
+
+# Shown in place of the name of a user that no longer exists.
+DELETED_USER_NAME = '(deleted user)'
+
+
 class User(ndb.Model):
     """User profile"""
     name = ndb.StringProperty(required=True)
     email =ndb.StringProperty()
     rankingscore = ndb.IntegerProperty(required = True)
+    wins = ndb.IntegerProperty(default = 0)
+    draws = ndb.IntegerProperty(default = 0)
+    losses = ndb.IntegerProperty(default = 0)
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the User with the given name, or None"""
+        key = _user_keys.get(name)
+        if key is None:
+            lookup = UserName.get_by_id(name)
+            if lookup:
+                key = lookup.user
+            else:
+                # Users created before the UserName index existed.
+                key = cls.query(cls.name == name).get(keys_only=True)
+                if key is None:
+                    return None
+                UserName(id=name, user=key).put()
+            _user_keys.set(name, key)
+        return get_user(key)
+
+    @classmethod
+    def create(cls, name, email=None):
+        """Creates a User with a unique name. Returns None if the name is
+        already taken."""
+        if cls.get_by_name(name):
+            return None
+        user = _create_user(name, email)
+        invalidate_user(name)
+        return user
+
+    def record_result(self, result):
+        """Updates the result counters and rankingscore for a finished game"""
+        if result == 'Win':
+            self.wins += 1
+        elif result == 'Draw':
+            self.draws += 1
+        else:
+            self.losses += 1
+        self.rankingscore = (RANKING_POINTS['Win'] * self.wins +
+                             RANKING_POINTS['Draw'] * self.draws +
+                             RANKING_POINTS['Lose'] * self.losses)
 
     def to_form(self):
         """Returns User Performance information"""
         form = UserForm()
         form.user_name = self.name
         form.rankingscore = self.rankingscore
+        form.wins = self.wins
+        form.draws = self.draws
+        form.losses = self.losses
         return form
         
 
+class UserName(ndb.Model):
+    """Unique index of user names, keyed by name"""
+    user = ndb.KeyProperty(required=True, kind='User')
+
+
+@ndb.transactional(xg=True)
+def _create_user(name, email):
+    if UserName.get_by_id(name):
+        return None
+    user = User(name=name, email=email, rankingscore = 0)
+    user.put()
+    UserName(id=name, user=user.key).put()
+    return user
+
+
+def get_user(key):
+    """Returns the User for the key, from the instance cache if possible"""
+    user = _users.get(key)
+    if user is None:
+        user = key.get()
+        if user:
+            _users.set(key, user)
+    return user
+
+
+def invalidate_user(name, key=None):
+    """Drops a user from the instance caches"""
+    _user_keys.delete(name)
+    if key:
+        _users.delete(key)
+
+
 class Game(ndb.Model):
     """Game object"""
     state = ndb.StringProperty(required = True)
     game_over = ndb.BooleanProperty(required=True, default=False)
     user = ndb.KeyProperty(required=True, kind='User')
     player = ndb.BooleanProperty(required = True) #True: Human Player; False: AIPlayer
+    # The second user ('X') of a two-player game; None when playing the AI.
+    opponent = ndb.KeyProperty(kind='User')
     movecount = ndb.IntegerProperty(required = True)
+    ai_mode = ndb.StringProperty(default = 'random')
+    rows = ndb.IntegerProperty(default = 3)
+    cols = ndb.IntegerProperty(default = 3)
+    win_length = ndb.IntegerProperty(default = 3)
+    # Packed move log: one byte per move holding the cell index. The human
+    # player always moves first and the players alternate.
+    moves = ndb.BlobProperty(default = '')
+    # Incremented on every saved change, for optimistic concurrency control.
+    version = ndb.IntegerProperty(default = 0)
+    # Idempotency keys of the latest requests that changed the game.
+    request_ids = ndb.StringProperty(repeated = True, indexed = False)
 
     @classmethod
-    def new_game(cls, user):
-        """Creates and returns a new game"""
+    def new_game(cls, user, ai_mode = 'random', rows = 3, cols = 3,
+                 win_length = 3, opponent = None):
+        """Creates and returns a new game. With an opponent the game is
+        played by two users, user moving first."""
+        return cls.new_game_async(user, ai_mode, rows, cols, win_length,
+                                  opponent).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def new_game_async(cls, user, ai_mode = 'random', rows = 3, cols = 3,
+                       win_length = 3, opponent = None):
+        """Creates a new game. The game is saved while the active games
+        counter is updated."""
         game = Game(user=user,
-                    state = "---------",
+                    opponent = opponent,
+                    state = "-" * (rows * cols),
                     game_over= False,
                     player = True,
-                    movecount = 0)
-        game.put()
-        return game
-
-    def to_form(self, message):
+                    movecount = 0,
+                    ai_mode = ai_mode,
+                    rows = rows,
+                    cols = cols,
+                    win_length = win_length)
+        yield game.put_async(), counters.add_to_shard_async(1)
+        counters.update_cache(1)
+        raise ndb.Return(game)
+
+    @property
+    def dimensions(self):
+        """(rows, cols, win_length) of the board"""
+        return self.rows, self.cols, self.win_length
+
+    def to_form(self, message, user_name = None):
         """Returns a GameForm representation of the Game"""
+        user_name, opponent_name = self._player_names(user_name)
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
+        form.user_name = user_name
+        form.opponent_name = opponent_name
         form.game_over = self.game_over
         form.message = message
         form.state = self.state
         form.player = self.player
         form.movecount = self.movecount
+        form.ai_mode = self.ai_mode
+        form.rows = self.rows
+        form.cols = self.cols
+        form.win_length = self.win_length
+        form.version = self.version
         return form
 
     def end_game(self, result):
-        """Ends the game - 3 Results("Win", "Lose", "Draw")"""
+        """Ends the game - 3 Results("Win", "Lose", "Draw")
+        The game, its Score and the user's ranking counters are saved in one
+        transaction, so a game is only ever counted once. Returns False if
+        the game was ended, cancelled or changed by another request."""
         self.game_over = True
-        self.put()
-        # Add the game to the score 'board'
-        score = Score(user=self.user, date=date.today(), result = result)
-
-
-    def history(self):
-        if self.player:
-            player = self.user.get().name
+        if not _end_game(self, result).get_result():
+            return False
+        counters.update_cache(-1)
+        # The cached Users no longer have the current ranking counters.
+        _users.delete(self.user)
+        if self.opponent:
+            _users.delete(self.opponent)
+        return True
+
+    def add_request_id(self, request_id):
+        """Records the idempotency key of a request that changed the game"""
+        self.request_ids = (self.request_ids +
+                            [request_id])[-REQUEST_ID_HISTORY:]
+
+
+    def cancel(self):
+        """Deletes the unfinished game. Returns False if it already ended."""
+        if not _cancel_game(self.key):
+            return False
+        counters.update_cache(-1)
+        return True
+
+    def record_move(self, cell):
+        """Appends a move to the packed move log. Call after updating
+        movecount."""
+        if not self.moves and self.movecount > 1:
+            # Game started before the move log existed: rebuild the earlier
+            # moves from its GameHistory records.
+            self.moves = self._legacy_moves()
+        self.moves += chr(cell)
+
+    def has_move_log(self):
+        """True if the move log holds every move of the game"""
+        return len(self.moves) == self.movecount
+
+    def history_forms(self, start, count, user_name = None):
+        """Returns GameHistoryForms for moves start to start + count, rebuilt
+        from the move log"""
+        user_name, opponent_name = self._player_names(user_name)
+        opponent_name = opponent_name or "AIPlayer"
+        board = ['-'] * (self.rows * self.cols)
+        forms = []
+        for index, cell in enumerate(bytearray(self.moves[:start + count])):
+            human = index % 2 == 0
+            board[cell] = 'O' if human else 'X'
+            if index >= start:
+                forms.append(history_form(index + 1,
+                                          user_name if human else opponent_name,
+                                          ''.join(board)))
+        return forms
+
+    def _player_names(self, user_name = None):
+        """Returns the names of the user and of the opponent (None when
+        playing the AI), fetching the missing ones in one batch"""
+        keys = [key for key in (None if user_name else self.user,
+                                self.opponent) if key]
+        names = user_names(keys) if keys else {}
+        user_name = user_name or names.get(self.user, DELETED_USER_NAME)
+        opponent_name = names.get(self.opponent, DELETED_USER_NAME) \
+            if self.opponent else None
+        return user_name, opponent_name
+
+    def _legacy_moves(self):
+        """Packs the moves recorded as GameHistory entities"""
+        moves = bytearray()
+        previous = '-' * (self.rows * self.cols)
+        records = GameHistory.query(GameHistory.game == self.key)\
+            .order(GameHistory.movecount)
+        for record in records:
+            moves.extend(cell for cell, (old, new)
+                         in enumerate(zip(previous, record.state))
+                         if old != new)
+            previous = record.state
+        return str(moves)
+
+
+def user_names(user_keys):
+    """Returns a dict mapping each User key to its name. Users missing from
+    the instance cache are fetched in a single batch get."""
+    names = {}
+    missing = []
+    for key in set(user_keys):
+        user = _users.get(key)
+        if user:
+            names[key] = user.name
         else:
-            player = "AIPlayer"
-        history = GameHistory(game = self.key, state = self.state, player = player, movecount = self.movecount)
-        history.put()
+            missing.append(key)
+    for key, user in zip(missing, ndb.get_multi(missing)):
+        if user:
+            _users.set(key, user)
+            names[key] = user.name
+    return names
+
+
+@ndb.transactional_tasklet(xg=True)
+def _end_game(game, result):
+    keys = [game.key, game.user]
+    if game.opponent:
+        keys.append(game.opponent)
+    entities = yield ndb.get_multi_async(keys)
+    stored = entities[0]
+    if stored is None or stored.game_over or stored.version >= game.version:
+        # Another request cancelled, ended or changed this game.
+        raise ndb.Return(False)
+    # Add the game to the score 'board' of each user
+    players = zip(entities[1:], [result, OPPOSITE_RESULT[result]])
+    updates = [game]
+    for user, user_result in players:
+        user.record_result(user_result)
+        updates += [user, Score(user=user.key, date=date.today(),
+                                result=user_result)]
+    yield ndb.put_multi_async(updates), counters.add_to_shard_async(-1)
+    raise ndb.Return(True)
+
+
+@ndb.transactional(xg=True)
+def _cancel_game(key):
+    game = key.get()
+    if not game or game.game_over:
+        return False
+    key.delete()
+    counters.add_to_shard(-1)
+    return True
 
 
 class Score(ndb.Model):
@@ -78,19 +335,37 @@ class Score(ndb.Model):
     date = ndb.DateProperty(required=True)
     result = ndb.StringProperty(required=True)
 
-    def to_form(self):
-        return ScoreForm(user_name=self.user.get().name, result=self.result,
+    def to_form(self, user_name = None):
+        if not user_name:
+            user = get_user(self.user)
+            user_name = user.name if user else DELETED_USER_NAME
+        return ScoreForm(user_name=user_name, result=self.result,
                          date=str(self.date))
 
 class GameHistory(ndb.Model):
-    """History for each game"""
+    """History for each game. No longer written: moves are now kept in
+    Game.moves, these records are only read for older games."""
     state = ndb.StringProperty(required = True)
     player = ndb.StringProperty()
     game = ndb.KeyProperty(required = True, kind = Game)
     movecount = ndb.IntegerProperty(required = True)
 
     def to_form(self):
-        return GameHistoryForm(movecount = self.movecount, player = self.player, state = self.state)
+        return history_form(self.movecount, self.player, self.state)
+
+
+def history_form(movecount, player, state):
+    """Returns a GameHistoryForm for one position of a game"""
+    form = GameHistoryForm(movecount = movecount, player = player,
+                           state = state)
+    if len(state) == 9:
+        # Imported here so the task handlers do not load the AI.
+        from utils import analyze
+        analysis = analyze(state)
+        # Position value from the human player's point of view.
+        form.value = analysis.value if analysis.to_move == 'O' \
+            else -analysis.value
+    return form
 
 
 class GameForm(messages.Message):
@@ -102,20 +377,41 @@ class GameForm(messages.Message):
     user_name = messages.StringField(5, required=True)
     player = messages.BooleanField(6,required = True)
     movecount = messages.IntegerField(7)
+    ai_mode = messages.StringField(8)
+    rows = messages.IntegerField(9)
+    cols = messages.IntegerField(10)
+    win_length = messages.IntegerField(11)
+    version = messages.IntegerField(12)
+    opponent_name = messages.StringField(13)
 
 
 class GameForms(messages.Message):
     """Return multiple GameForms"""
     items = messages.MessageField(GameForm,1,repeated = True)
+    next_cursor = messages.StringField(2)
 
 class NewGameForm(messages.Message):
     """Used to create a new game"""
     user_name = messages.StringField(1, required=True)
+    ai_mode = messages.StringField(2)
+    rows = messages.IntegerField(3, default=3)
+    cols = messages.IntegerField(4, default=3)
+    win_length = messages.IntegerField(5, default=3)
 
 
 class MakeMoveForm(messages.Message):
     """Used to make a move in an existing game"""
     move = messages.IntegerField(1, required=True)
+    request_id = messages.StringField(2)
+    user_name = messages.StringField(3)
+
+
+class MakeMovesForm(messages.Message):
+    """Used to make a sequence of moves in an existing game"""
+    moves = messages.IntegerField(1, repeated=True)
+    ai_reply = messages.BooleanField(2, default=False)
+    mode = messages.StringField(3)
+    request_id = messages.StringField(4)
 
 
 class GameHistoryForm(messages.Message):
@@ -123,10 +419,29 @@ class GameHistoryForm(messages.Message):
     player = messages.StringField(1)
     state = messages.StringField(2,required = True)
     movecount = messages.IntegerField(3)
+    value = messages.IntegerField(4)
 
 class GameHistoryForms(messages.Message):
     """Return multiple GameHistoryForms"""
     items = messages.MessageField(GameHistoryForm,1,repeated = True)
+    next_cursor = messages.StringField(2)
+
+
+class MatchForm(messages.Message):
+    """Outcome of a matchmaking request: the new game once matched"""
+    message = messages.StringField(1, required = True)
+    game = messages.MessageField(GameForm, 2)
+
+
+class MoveHintForm(messages.Message):
+    """One legal move rated with perfect play, for the player to move"""
+    move = messages.IntegerField(1, required = True)
+    value = messages.IntegerField(2, required = True)
+    distance = messages.IntegerField(3, required = True)
+
+class MoveHintForms(messages.Message):
+    """Return every legal move, best first"""
+    items = messages.MessageField(MoveHintForm, 1, repeated = True)
 
 
 class ScoreForm(messages.Message):
@@ -139,6 +454,7 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class StringMessage(messages.Message):
@@ -149,8 +465,33 @@ class UserForm(messages.Message):
     """UserForm for outbound User Information"""
     user_name = messages.StringField(1,required = True)
     rankingscore = messages.IntegerField(2, required = True)
+    wins = messages.IntegerField(3)
+    draws = messages.IntegerField(4)
+    losses = messages.IntegerField(5)
 
 class UserForms(messages.Message):
     """Return multiple UserForms"""
     items = messages.MessageField(UserForm,1, repeated = True)
-
+    next_cursor = messages.StringField(2)
+
+class RpcCountForm(messages.Message):
+    """Mean number of calls to one API method per request"""
+    name = messages.StringField(1, required = True)
+    mean = messages.FloatField(2, required = True)
+
+class EndpointStatsForm(messages.Message):
+    """Rolling latency and RPC statistics of one endpoint"""
+    endpoint = messages.StringField(1, required = True)
+    count = messages.IntegerField(2)
+    errors = messages.IntegerField(3)
+    p50_ms = messages.FloatField(4)
+    p95_ms = messages.FloatField(5)
+    p99_ms = messages.FloatField(6)
+    rpcs = messages.MessageField(RpcCountForm, 7, repeated = True)
+    request_bytes = messages.FloatField(8)
+    response_bytes = messages.FloatField(9)
+
+class EndpointStatsForms(messages.Message):
+    """Return multiple EndpointStatsForms"""
+    items = messages.MessageField(EndpointStatsForm, 1, repeated = True)
+    analysis_cache_hit_rate = messages.FloatField(2)
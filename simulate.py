@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""simulate.py - Offline self-play of many games on a process pool.
+
+Two strategies ('random', 'perfect' or 'search', as in Game.ai_mode) play
+each other with the rules of the API: the human player 'O' moves first, the
+players alternate, and a game ends on a winning line (mnk / utils.evaluate)
+or a full board. The random strategy picks any free cell like
+utils.add_random_move, 'perfect' plays the perfect-play table (3x3 only)
+and 'search' runs the alpha-beta search with the given time budget.
+
+Games are played in chunks on a process pool and written to a binary file
+as the chunks complete:
+
+    header:  MAGIC, then rows, cols and win_length as one byte each
+    game:    result byte, move count byte, then one byte per move holding
+             the cell index (the packing of Game.moves)
+
+Result codes are those of vectorized.py: 1 human ('O') wins, 2 AI ('X')
+wins, 3 draw. read_games() reads the file back.
+
+Usage:
+    python simulate.py --games 1000000 --human random --ai perfect \\
+        --output games.bin --workers 4
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import random
+import struct
+import sys
+import time
+
+import ai
+import analytics
+import mnk
+
+MAGIC = b'TTTSIM1\n'
+HUMAN_WINS = 1
+AI_WINS = 2
+DRAW = 3
+RESULTS = {HUMAN_WINS: 'Win', AI_WINS: 'Lose', DRAW: 'Draw'}
+STRATEGIES = ('random', 'perfect', 'search')
+CHUNK_SIZE = 1000
+
+
+class Player(object):
+    """One side of the simulated games"""
+
+    def __init__(self, board, strategy, mark, time_budget, depth):
+        if strategy not in STRATEGIES:
+            raise ValueError('Invalid strategy {!r}'.format(strategy))
+        if strategy == 'perfect' and board.cells != 9:
+            raise ValueError('The perfect strategy only plays 3x3')
+        self.board = board
+        self.strategy = strategy
+        self.mark = mark
+        self.time_budget = time_budget
+        self.depth = depth
+
+    def move(self, me, opp, rng):
+        """Returns the cell to play, given the masks of this player (me) and
+        of its opponent"""
+        if self.strategy == 'random':
+            taken = me | opp
+            return rng.choice([cell for cell in range(self.board.cells)
+                               if not taken & self.board.bits[cell]])
+        if self.strategy == 'perfect':
+            return ai.lookup(me, opp)[1][0]
+        if not me | opp:
+            # The search only considers cells near the marks on the board.
+            return self.board.centre_order[0]
+        search = mnk.AlphaBetaSearch(self.board, self.time_budget, self.depth)
+        x, o = (me, opp) if self.mark == mnk.AI else (opp, me)
+        return search.best_move(x, o, self.mark)
+
+
+def play(board, human, computer, rng):
+    """Plays one game and returns (result, moves) where moves is a
+    bytearray of cell indices"""
+    masks = [0, 0]
+    players = (human, computer)
+    moves = bytearray()
+    for ply in range(board.cells):
+        side = ply % 2
+        cell = players[side].move(masks[side], masks[1 - side], rng)
+        masks[side] |= board.bits[cell]
+        moves.append(cell)
+        if board.wins_at(masks[side], cell):
+            return (HUMAN_WINS if side == 0 else AI_WINS), moves
+    return DRAW, moves
+
+
+def play_chunk(task):
+    """Plays a chunk of games, run in the worker processes. Returns the
+    encoded games and their result counts."""
+    count, seed, options = task
+    board = mnk.variant(options['rows'], options['cols'],
+                        options['win_length'])
+    human = Player(board, options['human'], mnk.HUMAN,
+                   options['time_budget'], options['depth'])
+    computer = Player(board, options['ai'], mnk.AI,
+                      options['time_budget'], options['depth'])
+    rng = random.Random(seed)
+    data = bytearray()
+    stats = collections.Counter()
+    for _ in range(count):
+        result, moves = play(board, human, computer, rng)
+        data.extend(struct.pack('BB', result, len(moves)))
+        data.extend(moves)
+        stats[RESULTS[result]] += 1
+        stats['moves'] += len(moves)
+    return bytes(data), stats
+
+
+def tasks(games, seed, options, chunk_size=CHUNK_SIZE):
+    """Splits the games into chunks, each with its own seed so runs are
+    reproducible whatever the number of workers"""
+    for index, start in enumerate(range(0, games, chunk_size)):
+        yield min(chunk_size, games - start), seed * 1000003 + index, options
+
+
+def run(games, output, human='random', computer='perfect', rows=3, cols=3,
+        win_length=3, time_budget=0.01, depth=None, seed=0, workers=None):
+    """Plays the games, writes them to output and returns the summary"""
+    board = mnk.variant(rows, cols, win_length)
+    if board.cells > 255:
+        raise ValueError('Boards of more than 255 cells are not supported')
+    options = {'rows': rows, 'cols': cols, 'win_length': win_length,
+               'human': human, 'ai': computer, 'time_budget': time_budget,
+               'depth': depth}
+    # Fail before starting the pool if a strategy cannot play the board.
+    Player(board, human, mnk.HUMAN, time_budget, depth)
+    Player(board, computer, mnk.AI, time_budget, depth)
+
+    stats = collections.Counter()
+    start = time.time()
+    pool = multiprocessing.Pool(workers)
+    try:
+        with open(output, 'wb') as out:
+            out.write(MAGIC + struct.pack('BBB', rows, cols, win_length))
+            for data, partial in analytics.bounded_imap(
+                    pool, play_chunk, tasks(games, seed, options),
+                    max_pending=2 * (workers or multiprocessing.cpu_count())):
+                out.write(data)
+                stats.update(partial)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    return {'games': games,
+            'results': dict((name, stats[name]) for name in
+                            RESULTS.values()),
+            'average_length': float(stats['moves']) / games if games else 0.0,
+            'seconds': elapsed,
+            'games_per_second': games / elapsed if elapsed else 0.0}
+
+
+def read_games(path):
+    """Yields (result, moves) for every game of a simulation file, with
+    moves as a list of cell indices. The board size is in the header, see
+    read_header."""
+    with open(path, 'rb') as source:
+        read_header(source)
+        while True:
+            head = source.read(2)
+            if len(head) < 2:
+                return
+            result, count = struct.unpack('BB', head)
+            yield result, list(bytearray(source.read(count)))
+
+
+def read_header(source):
+    """Reads the file header and returns (rows, cols, win_length)"""
+    if source.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a simulation file')
+    return struct.unpack('BBB', source.read(3))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--human', default='random', choices=STRATEGIES,
+                        help='Strategy of the first player, O')
+    parser.add_argument('--ai', default='perfect', choices=STRATEGIES,
+                        help='Strategy of the second player, X')
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--cols', type=int, default=3)
+    parser.add_argument('--win-length', type=int, default=3)
+    parser.add_argument('--time-budget', type=float, default=0.01,
+                        help='Seconds per move of the search strategy')
+    parser.add_argument('--depth', type=int, default=None,
+                        help='Depth limit of the search strategy')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='games.bin')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+    try:
+        summary = run(args.games, args.output, args.human, args.ai, args.rows,
+                      args.cols, args.win_length, args.time_budget,
+                      args.depth, args.seed, args.workers)
+    except ValueError as e:
+        sys.exit(str(e))
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Tests of the bitboard engine, the perfect-play AI and its analysis
+cache (engine.py, ai.py, analysis.py)"""
+
+import unittest
+
+import ai
+import analysis
+import engine
+
+
+class EngineTest(unittest.TestCase):
+
+    def test_state_round_trip(self):
+        for state in ('---------', 'OX-XO---O', u'O---X----'):
+            self.assertEqual(engine.to_state(*engine.from_state(state)),
+                             state)
+
+    def test_winner(self):
+        self.assertEqual(engine.winner(*engine.from_state('OOOXX----')), 'O')
+        self.assertEqual(engine.winner(*engine.from_state('OO-XXXO--')), 'X')
+        self.assertIsNone(engine.winner(*engine.from_state('OXOOXXXOO')))
+
+    def test_invalid_state(self):
+        self.assertRaises(ValueError, engine.from_state, 'O--')
+        self.assertRaises(ValueError, engine.from_state, 'O---Y----')
+
+
+class AiTest(unittest.TestCase):
+
+    def test_empty_board_is_a_draw(self):
+        value, best = ai.lookup(0, 0)
+        self.assertEqual(value, 0)
+        self.assertEqual(len(best), 9)
+
+    def test_takes_the_win(self):
+        self.assertEqual(ai.best_move('OO-XX-O--'), 5)
+
+    def test_blocks_the_win(self):
+        self.assertEqual(ai.best_move('OO--X----'), 2)
+
+    def test_finished_game(self):
+        self.assertRaises(ValueError, ai.best_move, 'OOOXX----')
+
+
+class AnalysisCacheTest(unittest.TestCase):
+
+    def test_symmetric_boards_share_an_entry(self):
+        cache = analysis.AnalysisCache()
+        first = cache.get('O--------')
+        rotated = cache.get('--O------')
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(first.value, rotated.value)
+
+    def test_best_moves_are_mapped_back(self):
+        cache = analysis.AnalysisCache()
+        for state in ('OO--X----', '--X-OO---', 'X--OO----'):
+            x, o = engine.from_state(state)
+            self.assertEqual(set(cache.get(state).best_moves),
+                             set(ai.lookup(x, o)[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Tests of the precomputed move hints (book.py)"""
+
+import unittest
+
+import ai
+import book
+import engine
+
+
+class IndexTest(unittest.TestCase):
+
+    def test_empty_board_is_first_record(self):
+        self.assertEqual(book.index('-' * 9), 0)
+
+    def test_base_3_with_cell_0_first(self):
+        self.assertEqual(book.index('O--------'), 3 ** 8)
+        self.assertEqual(book.index('--------X'), 2)
+
+    def test_unicode_state(self):
+        # ndb returns StringProperty values as unicode.
+        self.assertEqual(book.index(u'O---X----'), book.index('O---X----'))
+
+    def test_invalid_state(self):
+        self.assertRaises(ValueError, book.index, 'O---X---')
+        self.assertRaises(ValueError, book.index, 'O---Y----')
+
+
+class HintsTest(unittest.TestCase):
+
+    def test_unicode_state(self):
+        self.assertEqual(book.hints(u'O---X----'), book.hints('O---X----'))
+
+    def test_best_hint_is_a_perfect_move(self):
+        for state in ('---------', 'O--------', 'O---X----', 'OO--X----'):
+            x, o = engine.from_state(state)
+            me, opp = (o, x) if state.count('O') == state.count('X') \
+                else (x, o)
+            self.assertIn(book.hints(state)[0].move, ai.lookup(me, opp)[1])
+
+    def test_winning_move_first(self):
+        # 'O' to move wins at once on cell 2.
+        hint = book.hints('OO-XX----')[0]
+        self.assertEqual(hint, book.Hint(2, 1, 1))
+
+    def test_finished_game_has_no_hints(self):
+        self.assertEqual(book.hints('OOOXX----'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
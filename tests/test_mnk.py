@@ -0,0 +1,68 @@
+"""Tests of the m,n,k board engine and alpha-beta search (mnk.py)"""
+
+import unittest
+
+import mnk
+
+
+class VariantTest(unittest.TestCase):
+
+    def test_evaluate(self):
+        self.assertEqual(mnk.evaluate('OOOO' + '-' * 12, 4, 4, 4), 'O')
+        self.assertEqual(mnk.evaluate('X----X----X----X', 4, 4, 4), 'X')
+        self.assertIsNone(mnk.evaluate('OOO-' + '-' * 12, 4, 4, 4))
+        self.assertEqual(mnk.evaluate(u'OOOXX----'), 'O')
+
+    def test_invalid_variant(self):
+        self.assertRaises(ValueError, mnk.variant, 2, 3, 3)
+        self.assertRaises(ValueError, mnk.variant, 4, 4, 5)
+
+    def test_variant_cache_is_bounded(self):
+        for size in range(mnk.MIN_SIZE, mnk.MAX_SIZE + 1):
+            for win_length in range(mnk.MIN_SIZE, size + 1):
+                mnk.variant(size, size, win_length)
+        self.assertLessEqual(len(mnk._VARIANTS._entries), mnk.MAX_VARIANTS)
+
+    def test_empty_boards_hash_apart(self):
+        self.assertNotEqual(mnk.variant(4, 4, 4).hash(0, 0),
+                            mnk.variant(5, 5, 4).hash(0, 0))
+
+
+class ClearingSearch(mnk.AlphaBetaSearch):
+    """Clears the shared table after every root search, as a concurrent
+    search on another thread may"""
+
+    def _negamax(self, me, opp, h, side, depth, ply, alpha, beta):
+        value = super(ClearingSearch, self)._negamax(
+            me, opp, h, side, depth, ply, alpha, beta)
+        if ply == 0:
+            self.table.clear()
+        return value
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_takes_the_win(self):
+        state = 'OOO-' + 'XXX-' + '-' * 8
+        self.assertEqual(mnk.best_move(state, 4, 4, 4, 0.2, mark='O'), 3)
+        self.assertEqual(mnk.best_move(state, 4, 4, 4, 0.2), 7)
+
+    def test_blocks_the_win(self):
+        state = 'OOO-' + 'X---' + 'X---' + '-' * 4
+        self.assertEqual(mnk.best_move(state, 4, 4, 4, 0.2), 3)
+
+    def test_table_is_bounded(self):
+        mnk._TABLE.update((key, None) for key in
+                          range(mnk.MAX_TABLE_ENTRIES + 1))
+        mnk.AlphaBetaSearch(mnk.variant(4, 4, 4), 0.1)
+        self.assertEqual(len(mnk._TABLE), 0)
+
+    def test_table_cleared_during_search(self):
+        board = mnk.variant(4, 4, 4)
+        x, o = board.from_state('OOO-' + 'X---' + 'X---' + '-' * 4)
+        search = ClearingSearch(board, 0.2, max_depth=3)
+        self.assertEqual(search.best_move(x, o), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
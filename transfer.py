@@ -0,0 +1,283 @@
+"""transfer.py - Bulk export and import of the game data.
+
+An export walks User, Game, Score and GameHistory with query cursors and
+writes each kind as gzipped JSONL chunks of CHUNK_SIZE entities to Cloud
+Storage, in the format read by analytics.py (plus the fields needed to
+import them again):
+
+    /<bucket>/exports/<job>/<kind>-<chunk>.jsonl.gz
+
+An import reads the chunks of an export back and writes them with
+put_multi in batches of BATCH_SIZE, keeping each entity's key, so running
+it twice does not duplicate anything. Both run as a chain of tasks, one
+chunk per task, and keep their progress in a TransferJob entity: a retried
+or restarted task resumes from its last checkpoint, and each task's work is
+bounded by the chunk size whatever the size of the datastore.
+
+Games are exported with their cached state (see gamecache.py), so moves
+not yet written to the datastore are included. An export is not a
+snapshot: entities changed while it runs may be exported before or after
+the change.
+
+The cloudstorage client library (GoogleAppEngineCloudStorageClient) must be
+deployed with the app; it is only imported by the transfer tasks."""
+
+import gzip
+import json
+import logging
+import uuid
+from datetime import datetime
+
+from google.appengine.api import app_identity, taskqueue
+from google.appengine.ext import ndb
+
+import counters
+from models import User, UserName, Game, Score, GameHistory
+
+# Entities per query page and per put_multi.
+BATCH_SIZE = 500
+# Entities per exported file, and per task.
+CHUNK_SIZE = 10000
+
+# Kinds in export and import order: users first, so imported games and
+# scores refer to existing users.
+KINDS = ('users', 'games', 'scores', 'history')
+
+
+class TransferJob(ndb.Model):
+    """Progress of an export or import, the checkpoint its tasks resume
+    from"""
+    operation = ndb.StringProperty(required=True, choices=('export', 'import'))
+    # Cloud Storage directory of the chunks.
+    path = ndb.StringProperty(required=True, indexed=False)
+    kind = ndb.StringProperty(default=KINDS[0], indexed=False)
+    chunk = ndb.IntegerProperty(default=0, indexed=False)
+    # Export: query cursor of the next chunk. Import: lines of the current
+    # chunk already written.
+    cursor = ndb.StringProperty(indexed=False)
+    line = ndb.IntegerProperty(default=0, indexed=False)
+    entities = ndb.IntegerProperty(default=0, indexed=False)
+    done = ndb.BooleanProperty(default=False)
+    started = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+def _key(urlsafe):
+    """Returns the key in this application, whichever app exported it"""
+    return ndb.Key(pairs=ndb.Key(urlsafe=urlsafe).pairs()) if urlsafe \
+        else None
+
+
+def _urlsafe(key):
+    return key.urlsafe() if key else None
+
+
+def _user_record(user):
+    return {'key': user.key.urlsafe(), 'name': user.name, 'email': user.email,
+            'rankingscore': user.rankingscore, 'wins': user.wins,
+            'draws': user.draws, 'losses': user.losses}
+
+
+def _user_entities(record):
+    user = User(key=_key(record['key']), name=record['name'],
+                email=record.get('email'),
+                rankingscore=record.get('rankingscore') or 0,
+                wins=record.get('wins') or 0, draws=record.get('draws') or 0,
+                losses=record.get('losses') or 0)
+    return [user, UserName(id=user.name, user=user.key)]
+
+
+def _game_record(game):
+    return {'key': game.key.urlsafe(), 'user': game.user.urlsafe(),
+            'opponent': _urlsafe(game.opponent), 'state': game.state,
+            'game_over': game.game_over, 'player': game.player,
+            'movecount': game.movecount, 'moves': list(bytearray(game.moves)),
+            'ai_mode': game.ai_mode, 'rows': game.rows, 'cols': game.cols,
+            'win_length': game.win_length, 'version': game.version}
+
+
+def _game_entities(record):
+    return [Game(key=_key(record['key']), user=_key(record['user']),
+                 opponent=_key(record.get('opponent')),
+                 state=record['state'], game_over=record['game_over'],
+                 player=record['player'], movecount=record['movecount'],
+                 moves=str(bytearray(record.get('moves') or [])),
+                 ai_mode=record.get('ai_mode'), rows=record.get('rows') or 3,
+                 cols=record.get('cols') or 3,
+                 win_length=record.get('win_length') or 3,
+                 version=record.get('version') or 0)]
+
+
+def _score_record(score):
+    return {'key': score.key.urlsafe(), 'user': score.user.urlsafe(),
+            'date': score.date.isoformat(), 'result': score.result}
+
+
+def _score_entities(record):
+    return [Score(key=_key(record['key']), user=_key(record['user']),
+                  date=datetime.strptime(record['date'], '%Y-%m-%d').date(),
+                  result=record['result'])]
+
+
+def _history_record(history):
+    return {'key': history.key.urlsafe(), 'game': history.game.urlsafe(),
+            'movecount': history.movecount, 'state': history.state,
+            'player': history.player}
+
+
+def _history_entities(record):
+    return [GameHistory(key=_key(record['key']), game=_key(record['game']),
+                        movecount=record['movecount'], state=record['state'],
+                        player=record.get('player'))]
+
+
+# kind -> (query, entity to record, record to entities)
+_KINDS = {
+    'users': (lambda: User.query(), _user_record, _user_entities),
+    'games': (lambda: Game.query(), _game_record, _game_entities),
+    'scores': (lambda: Score.query(), _score_record, _score_entities),
+    # Sorted by game, then movecount, as analytics.py expects.
+    'history': (lambda: GameHistory.query().order(GameHistory.game,
+                                                  GameHistory.movecount),
+                _history_record, _history_entities),
+}
+
+
+def _chunk_path(job):
+    return '{}/{}-{:05d}.jsonl.gz'.format(job.path, job.kind, job.chunk)
+
+
+def _next_kind(job):
+    """Moves the job to the first chunk of the next kind. Returns False
+    when all kinds are done."""
+    index = KINDS.index(job.kind) + 1
+    job.chunk, job.cursor, job.line = 0, None, 0
+    if index == len(KINDS):
+        job.done = True
+        return False
+    job.kind = KINDS[index]
+    return True
+
+
+def _queue(job):
+    """Queues the task of the job's current chunk. Tasks are named after
+    it, so a retried task does not start a second chain."""
+    try:
+        taskqueue.add(url='/tasks/transfer',
+                      name='{}-{}-{}'.format(job.key.id(), job.kind,
+                                             job.chunk),
+                      params={'job': job.key.id()})
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info('Chunk %s of %s already queued', job.chunk, job.kind)
+
+
+def _job_id(operation):
+    """Returns a new job id, unique even for jobs started the same second"""
+    return '{}-{}-{}'.format(operation,
+                             datetime.utcnow().strftime('%Y%m%d-%H%M%S'),
+                             uuid.uuid4().hex[:8])
+
+
+def start_export():
+    """Starts an export and returns its job id, also the name of its
+    directory in the default bucket"""
+    job_id = _job_id('export')
+    path = '/{}/exports/{}'.format(
+        app_identity.get_default_gcs_bucket_name(), job_id)
+    job = TransferJob(id=job_id, operation='export', path=path)
+    job.put()
+    _queue(job)
+    return job_id
+
+
+def start_import(path):
+    """Starts importing the export in the Cloud Storage directory path
+    (/bucket/exports/<job>) and returns the job id"""
+    job_id = _job_id('import')
+    job = TransferJob(id=job_id, operation='import', path=path.rstrip('/'))
+    job.put()
+    _queue(job)
+    return job_id
+
+
+def run_chunk(job_id):
+    """Task: exports or imports the job's current chunk, saves the
+    checkpoint and queues the next chunk"""
+    job = TransferJob.get_by_id(job_id)
+    if not job or job.done:
+        return
+    if job.operation == 'export':
+        _export_chunk(job)
+    else:
+        _import_chunk(job)
+    job.put()
+    if job.done:
+        logging.info('%s finished: %s entities', job_id, job.entities)
+        if job.operation == 'import':
+            counters.reset(Game.query(Game.game_over == False).count())
+    else:
+        _queue(job)
+
+
+def _export_chunk(job):
+    import cloudstorage
+    import gamecache
+
+    query, to_record, _ = _KINDS[job.kind]
+    query = query()
+    cursor = ndb.Cursor(urlsafe=job.cursor) if job.cursor else None
+    count, more = 0, True
+    # A retried task rewrites the same file from the same cursor.
+    with cloudstorage.open(_chunk_path(job), 'w',
+                           content_type='application/gzip') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as output:
+            while more and count < CHUNK_SIZE:
+                entities, cursor, more = query.fetch_page(
+                    BATCH_SIZE, start_cursor=cursor)
+                if job.kind == 'games':
+                    entities = gamecache.refresh(entities)
+                for entity in entities:
+                    output.write(json.dumps(to_record(entity)) + '\n')
+                count += len(entities)
+    job.entities += count
+    if more and cursor:
+        job.chunk += 1
+        job.cursor = cursor.urlsafe()
+    else:
+        _next_kind(job)
+
+
+def _import_chunk(job):
+    import cloudstorage
+
+    _, _, to_entities = _KINDS[job.kind]
+    try:
+        raw = cloudstorage.open(_chunk_path(job))
+    except cloudstorage.NotFoundError:
+        # No more chunks of this kind.
+        _next_kind(job)
+        return
+    batch, records = [], 0
+    with raw:
+        with gzip.GzipFile(fileobj=raw, mode='rb') as lines:
+            for number, line in enumerate(lines):
+                if number < job.line:
+                    # Written before the task was interrupted.
+                    continue
+                batch.extend(to_entities(json.loads(line)))
+                records += 1
+                if records == BATCH_SIZE:
+                    _save_batch(job, batch, number + 1, records)
+                    batch, records = [], 0
+    if records:
+        _save_batch(job, batch, job.line + records, records)
+    job.chunk += 1
+    job.line = 0
+
+
+def _save_batch(job, entities, line, records):
+    """Writes a batch, then checkpoints the lines of the chunk done"""
+    ndb.put_multi(entities)
+    job.line = line
+    job.entities += records
+    job.put()
@@ -5,6 +5,12 @@ from google.appengine.ext import ndb
 import endpoints
 import re,random
 
+import mnk
+from analysis import AnalysisCache
+
+# Shared by every request served by this instance.
+analysis_cache = AnalysisCache()
+
 def get_by_urlsafe(urlsafe, model):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
         that the type of entity returned is of the correct kind. Raises an
@@ -36,30 +42,58 @@ def get_by_urlsafe(urlsafe, model):
     return entity
 
 
-def parseState(state):
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Time budget in seconds for the alpha-beta AI on each request.
+SEARCH_TIME_BUDGET = 0.5
+
+def get_cursor(urlsafe):
+    """Returns the ndb.Cursor for a urlsafe cursor string, or None if the
+    string is empty. Raises BadRequestException if the string is malformed."""
+    if not urlsafe:
+        return None
+    try:
+        return ndb.Cursor(urlsafe=urlsafe)
+    except Exception:
+        raise endpoints.BadRequestException('Invalid cursor')
+
+
+def clamp_page_size(requested):
+    """Returns the requested page size, or the default, capped at
+    MAX_PAGE_SIZE"""
+    return min(max(requested or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+
+def fetch_page(query, page_size=None, cursor=None, **options):
+    """Fetches one page of query results.
+    Args:
+        query: The ndb.Query to run
+        page_size: Requested page size, capped at MAX_PAGE_SIZE
+        cursor: urlsafe cursor string returned by the previous page
+        options: Extra query options such as projection or keys_only
+    Returns:
+        (results, next_cursor) where next_cursor is the urlsafe cursor of the
+        next page, or None on the last page."""
+    results, next_cursor, more = query.fetch_page(
+        clamp_page_size(page_size), start_cursor=get_cursor(cursor), **options)
+    return results, next_cursor.urlsafe() if more and next_cursor else None
+
+
+def parseState(state, cols=3):
     """Parse the game state into list"""
-    result = [list(state[:3]),list(state[3:6]),list(state[6:])] 
+    result = [list(state[i:i + cols]) for i in range(0, len(state), cols)]
     return result
 
-def evaluate(state):
-    board = parseState(state)
-    #win horizontally
-    for row in board:
-        if row[0] and row[0] == row[1] and row[0] == row[2] and row[0] in "XO":
-          return row[0]
-    #win vertically
-    for col in range(0,3):
-      if board[0][col] and board[0][col] == board[1][col] and \
-          board[0][col] == board[2][col] and board[0][col] in "XO" :
-          return board[0][col]
-    #win diagonally
-    if (board[0][0] and board[0][0] == board[1][1] and board[0][0] == board[2][2]) \
-          and board[0][0] in "XO":
-          return board[0][0]
-    if (board[2][0] and board[2][0] == board[1][1] and board[2][0] == board[0][2]) \
-          and board[2][0] in "XO":
-          return board[2][0] 
-    return None
+def evaluate(state, rows=3, cols=3, win_length=3):
+    """Return the winning mark ('O' or 'X') of the state, or None"""
+    return mnk.evaluate(state, rows, cols, win_length)
+
+def evaluate_many(states, rows=3, cols=3, win_length=3):
+    """Evaluates many states at once, see vectorized.evaluate_many.
+    NumPy is only imported by the requests that need it."""
+    import vectorized
+    return vectorized.evaluate_many(states, rows, cols, win_length)
 
 def add_random_move(state):
     """
@@ -74,3 +108,29 @@ def add_random_move(state):
     return ''.join(result)
 
 
+def analyze(state):
+    """Return the cached Analysis (winner, game_over, to_move, best_moves,
+    value) of the state"""
+    return analysis_cache.get(state)
+
+# AI modes that can be chosen per game or per request.
+AI_MODES = ('random', 'perfect', 'search')
+
+def check_ai_mode(mode, rows=3, cols=3, win_length=3):
+    """Raises BadRequestException unless mode can play the given variant"""
+    if mode not in AI_MODES:
+        raise endpoints.BadRequestException('Invalid AI mode')
+    if mode == 'perfect' and (rows, cols, win_length) != (3, 3, 3):
+        raise endpoints.BadRequestException(
+            'The perfect AI only plays 3x3 Tic-tac-toe')
+
+def choose_ai_move(state, mode, rows=3, cols=3, win_length=3):
+    """Returns the cell the AI plays in the given mode"""
+    if mode == 'perfect':
+        best_moves = analyze(state).best_moves
+        if not best_moves:
+            raise ValueError('Game already over')
+        return best_moves[0]
+    if mode == 'search':
+        return mnk.best_move(state, rows, cols, win_length, SEARCH_TIME_BUDGET)
+    return random.choice([match.start() for match in re.finditer('-', state)])
@@ -0,0 +1,106 @@
+"""vectorized.py - Evaluate many boards at once with NumPy.
+
+evaluate_many is the batch counterpart of utils.evaluate for jobs that look
+at large numbers of stored games (reminder sweeps, leaderboard rebuilds,
+history replays, consistency audits). Boards are turned into one uint8 array
+and every winning line is tested for all boards with array operations.
+
+3x3 boards are packed into 9-bit masks, so the whole check is one lookup in
+the precomputed table of engine.py per player. Other board sizes gather the
+cells of every winning line from mnk.py."""
+
+import numpy as np
+
+import engine
+import mnk
+
+# Result codes returned by evaluate_many.
+NO_RESULT = 0
+HUMAN_WINS = 1
+AI_WINS = 2
+DRAW = 3
+
+_WINNERS = {NO_RESULT: None, HUMAN_WINS: engine.HUMAN, AI_WINS: engine.AI,
+            DRAW: None}
+
+_WINNING = np.array(engine._WINNING, dtype=bool)
+_WEIGHTS = 1 << np.arange(engine.CELLS, dtype=np.int32)
+_LINE_CELLS = {}
+
+
+def encode(states, cells=engine.CELLS):
+    """Packs Game.state strings into an (n, cells) uint8 array"""
+    if isinstance(states, np.ndarray):
+        return states
+    data = ''.join(states).encode('ascii')
+    if len(data) != len(states) * cells:
+        raise ValueError('Invalid state length')
+    return np.frombuffer(data, dtype=np.uint8).reshape(len(states), cells)
+
+
+def pack(boards):
+    """Returns the (x, o) mask arrays of an (n, 9) uint8 board array"""
+    x = ((boards == ord(engine.AI)) * _WEIGHTS).sum(axis=1)
+    o = ((boards == ord(engine.HUMAN)) * _WEIGHTS).sum(axis=1)
+    return x, o
+
+
+def evaluate_masks(x, o):
+    """Returns the result codes of 3x3 boards given as mask arrays"""
+    x = np.asarray(x, dtype=np.int32)
+    o = np.asarray(o, dtype=np.int32)
+    human = _WINNING[o]
+    ai = _WINNING[x] & ~human
+    full = (x | o) == engine.FULL_MASK
+    result = np.zeros(len(x), dtype=np.int8)
+    result[full] = DRAW
+    result[ai] = AI_WINS
+    result[human] = HUMAN_WINS
+    return result
+
+
+def _line_cells(rows, cols, win_length):
+    key = (rows, cols, win_length)
+    cells = _LINE_CELLS.get(key)
+    if cells is None:
+        board = mnk.variant(rows, cols, win_length)
+        cells = np.array([[cell for cell in range(board.cells)
+                           if line & board.bits[cell]]
+                          for line in board.lines], dtype=np.intp)
+        _LINE_CELLS[key] = cells
+    return cells
+
+
+def evaluate_many(states, rows=3, cols=3, win_length=3):
+    """Evaluates many boards at once.
+    Args:
+        states: A sequence of Game.state strings, an (n, rows * cols) uint8
+            array of their characters, or for 3x3 boards an (n, 2) array of
+            (x, o) masks
+        rows, cols, win_length: The board variant shared by all states
+    Returns:
+        An int8 array of result codes: NO_RESULT, HUMAN_WINS, AI_WINS or
+        DRAW."""
+    if (rows, cols, win_length) == (3, 3, 3):
+        if isinstance(states, np.ndarray) and states.ndim == 2 and \
+                states.shape[1] == 2:
+            return evaluate_masks(states[:, 0], states[:, 1])
+        return evaluate_masks(*pack(encode(states)))
+
+    boards = encode(states, rows * cols)
+    lines = _line_cells(rows, cols, win_length)
+    human = (boards == ord(engine.HUMAN))[:, lines].all(axis=2).any(axis=1)
+    ai = (boards == ord(engine.AI))[:, lines].all(axis=2).any(axis=1) & ~human
+    full = (boards != ord(engine.EMPTY)).all(axis=1)
+    result = np.zeros(len(boards), dtype=np.int8)
+    result[full] = DRAW
+    result[ai] = AI_WINS
+    result[human] = HUMAN_WINS
+    return result
+
+
+def winners(states, rows=3, cols=3, win_length=3):
+    """Returns a list of the winning marks ('O', 'X' or None), like calling
+    utils.evaluate on each state"""
+    return [_WINNERS[code]
+            for code in evaluate_many(states, rows, cols, win_length).tolist()]